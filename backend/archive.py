@@ -0,0 +1,152 @@
+"""Streaming event archives, for moving finished events out of the database.
+
+An archive is an uncompressed tar (photos are already compressed) holding:
+
+    event.json                  the event document
+    photos/<photo_key>          each original photo, once
+    memories/000001.ndjson      memory documents, one per line, in batches
+
+Photos of a batch precede its NDJSON file, so an import can store them before
+inserting the memories that reference them. Export reads memories through a
+cursor and holds at most one batch and one photo in memory; import inserts
+each batch with a single ``insert_many``.
+"""
+import asyncio
+import io
+import json
+import logging
+import tarfile
+import time
+
+from pymongo.errors import BulkWriteError
+
+from images import store_photo
+from storage import is_blob_key, BlobNotFound
+
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE = 500
+
+
+class InvalidArchive(ValueError):
+    pass
+
+
+class _Chunks:
+    """Write target for tarfile's stream mode that hands out what was written."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def _add(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+async def stream_event_archive(db, blob_store, event, batch_size=ARCHIVE_BATCH_SIZE):
+    """Yield the tar archive of ``event`` and its memories in chunks."""
+    out = _Chunks()
+    tar = tarfile.open(fileobj=out, mode="w|")
+    _add(tar, "event.json", json.dumps(event, default=str).encode())
+    yield out.drain()
+
+    written = set()
+    batch = []
+    batch_number = 0
+    cursor = db.memories.find({"event_id": event["id"]}, {"_id": 0}).sort("created_at", 1).batch_size(batch_size)
+    async for memory in cursor:
+        key = memory.get("photo_key")
+        if key and key not in written:
+            written.add(key)
+            try:
+                _add(tar, f"photos/{key}", await blob_store.get(key))
+            except BlobNotFound:
+                logger.warning("Photo %s of memory %s is missing from the blob store", key, memory.get("id"))
+            yield out.drain()
+        batch.append(memory)
+        if len(batch) >= batch_size:
+            batch_number += 1
+            _add(tar, f"memories/{batch_number:06d}.ndjson", _ndjson(batch))
+            batch = []
+            yield out.drain()
+    if batch:
+        batch_number += 1
+        _add(tar, f"memories/{batch_number:06d}.ndjson", _ndjson(batch))
+    tar.close()
+    yield out.drain()
+
+
+def _ndjson(documents):
+    return b"".join(json.dumps(doc, default=str).encode() + b"\n" for doc in documents)
+
+
+async def import_event_archive(db, blob_store, path, batch_size=ARCHIVE_BATCH_SIZE):
+    """Restore an archive written by ``stream_event_archive`` from ``path``.
+
+    Returns the event document and the number of memories inserted; memories
+    that already exist are skipped. The event must not exist yet, callers
+    handle the ``DuplicateKeyError``. If the import fails after that, the
+    event and the memories inserted for it are removed again, so it can be
+    retried.
+    """
+    tar = await asyncio.to_thread(tarfile.open, path, "r:")
+    try:
+        members = await asyncio.to_thread(tar.getmembers)
+        if not members or members[0].name != "event.json":
+            raise InvalidArchive("Archive does not start with event.json")
+        event = json.loads(await _read_member(tar, members[0]))
+        if not isinstance(event, dict) or not event.get("id"):
+            raise InvalidArchive("event.json has no event id")
+        # Inserted first so an existing event fails the import before anything
+        # is written
+        await db.events.insert_one(dict(event))
+        try:
+            # Renditions rendered during this import, by photo key
+            rendered = {}
+            imported = 0
+            for member in members[1:]:
+                if not member.isfile():
+                    continue
+                if member.name.startswith("photos/"):
+                    key = member.name[len("photos/"):]
+                    if not is_blob_key(key) or await blob_store.exists(key):
+                        continue
+                    _, rendered[key] = await store_photo(blob_store, await _read_member(tar, member))
+                elif member.name.startswith("memories/"):
+                    lines = (await _read_member(tar, member)).splitlines()
+                    memories = [json.loads(line) for line in lines if line.strip()]
+                    for memory in memories:
+                        memory["event_id"] = event["id"]
+                        if memory.get("photo_key") in rendered:
+                            memory["photo_renditions"] = rendered[memory["photo_key"]]
+                    for start in range(0, len(memories), batch_size):
+                        try:
+                            result = await db.memories.insert_many(memories[start:start + batch_size], ordered=False)
+                            imported += len(result.inserted_ids)
+                        except BulkWriteError as e:
+                            # Memories already present (by id) are skipped
+                            imported += e.details.get("nInserted", 0)
+            return event, imported
+        except BaseException:
+            await db.memories.delete_many({"event_id": event["id"]})
+            await db.events.delete_one({"id": event["id"]})
+            raise
+    finally:
+        tar.close()
+
+
+async def _read_member(tar, member):
+    return await asyncio.to_thread(lambda: tar.extractfile(member).read())
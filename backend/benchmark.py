@@ -0,0 +1,342 @@
+"""Reproducible local benchmarks for the API and the PDF renderer.
+
+Run from the backend directory:
+
+    python benchmark.py [--mongo-url mongodb://localhost:27017] [--quick]
+                        [--only submission,listing,events,pdf] [--output benchmark-results.json]
+
+Requests go through an in-process ASGI client, so no server or network is
+involved. Without ``--mongo-url`` the database is mongomock (``pip install
+mongomock-motor``), which measures the application code rather than MongoDB;
+with it a throwaway database on that server is used and dropped afterwards.
+Blobs, exports and the page cache live in a temporary directory.
+
+Results are written as JSON together with the commit and environment, so runs
+can be compared between commits. Every run also records an import-time
+profile of ``server`` taken in a fresh interpreter, the cost a new worker pays
+before it can serve its first request.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+
+SCENARIOS = ("submission", "listing", "events", "pdf")
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(ordered[-1] * 1000, 3)}
+
+
+def photo_bytes(edge, seed):
+    """A JPEG with photo-like entropy, so sizes and decode costs are realistic."""
+    from PIL import Image
+    rng = random.Random(seed)
+    small = Image.effect_noise((max(edge // 16, 8), max(edge * 3 // 64, 6)), 64).convert("RGB")
+    tint = Image.new("RGB", small.size, tuple(rng.randrange(256) for _ in range(3)))
+    img = Image.blend(small, tint, 0.5).resize((edge, edge * 3 // 4), Image.BICUBIC)
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+class RssSampler:
+    """Samples resident memory of this process and its children (the PDF
+    worker pool) and keeps the peak. Linux only; reports None elsewhere."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        import multiprocessing
+        while not self._stop.is_set():
+            pids = [os.getpid()] + [child.pid for child in multiprocessing.active_children()]
+            self.peak = max(self.peak, sum(_rss(pid) for pid in pids))
+            self._stop.wait(self.interval)
+
+    @property
+    def peak_mb(self):
+        return round(self.peak / 1024 / 1024, 1) if self.peak else None
+
+
+def _rss(pid):
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class Bench:
+    def __init__(self, server, client, quick):
+        self.server = server
+        self.client = client
+        self.quick = quick
+
+    async def create_event(self, name="Bench"):
+        response = await self.client.post("/api/events", json={"name": name, "couple_names": "Ana & Pavle"})
+        response.raise_for_status()
+        return response.json()
+
+    async def seed_memories(self, event_id, count, photo_edge=None):
+        """Insert ``count`` memories directly, with distinct photos if requested."""
+        server = self.server
+        base = datetime.now(timezone.utc) - timedelta(days=1)
+        docs = []
+        for i in range(count):
+            doc = {
+                "id": str(uuid.uuid4()),
+                "event_id": event_id,
+                "guest_name": f"Guest {i}",
+                "message": "We wish you a lifetime of love and laughter. " * 3,
+                "question": "What is your favourite memory with the couple?",
+                "tone": "heartfelt",
+                "photo": None,
+                "created_at": (base + timedelta(seconds=i)).isoformat(),
+            }
+            if photo_edge:
+                doc["photo_key"], doc["photo_renditions"] = await server.store_photo(
+                    server.blob_store, photo_bytes(photo_edge, i))
+            docs.append(doc)
+        for start in range(0, len(docs), 1000):
+            await server.db.memories.insert_many(docs[start:start + 1000])
+        await server.db.events.update_one({"id": event_id}, {"$unset": {"memory_count": ""}})
+
+    async def submission(self):
+        """Guest submissions with a photo through the multipart endpoint."""
+        event = await self.create_event()
+        total, concurrency = (40, 8) if self.quick else (200, 16)
+        photos = [photo_bytes(2048, seed) for seed in range(8)]
+        latencies, errors = [], 0
+        slots = asyncio.Semaphore(concurrency)
+
+        async def submit(i):
+            nonlocal errors
+            async with slots:
+                start = time.perf_counter()
+                response = await self.client.post(
+                    "/api/memories/upload",
+                    data={"event_code": event["code"], "guest_name": f"Guest {i}", "message": "Congratulations!"},
+                    files={"photo": ("photo.jpg", photos[i % len(photos)], "image/jpeg")},
+                )
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code != 201
+
+        start = time.perf_counter()
+        await asyncio.gather(*(submit(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+        return {"requests": total, "concurrency": concurrency, "errors": errors,
+                "throughput_rps": round(total / elapsed, 2), **percentiles(latencies)}
+
+    async def listing(self):
+        """First-page and full-walk latency of an event's memory listing."""
+        results = {}
+        for size in (100, 1000) if self.quick else (100, 1000, 10000):
+            event = await self.create_event(f"Listing {size}")
+            await self.seed_memories(event["id"], size)
+            url = f"/api/events/{event['id']}/memories"
+            first_page = []
+            for _ in range(20):
+                start = time.perf_counter()
+                (await self.client.get(url, params={"limit": 50})).raise_for_status()
+                first_page.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            cursor, pages = None, 0
+            while True:
+                params = {"limit": 200, **({"cursor": cursor} if cursor else {})}
+                response = await self.client.get(url, params=params)
+                pages += 1
+                cursor = response.headers.get("x-next-cursor")
+                if not cursor:
+                    break
+            results[str(size)] = {"first_page": percentiles(first_page),
+                                  "full_walk_ms": round((time.perf_counter() - start) * 1000, 3), "pages": pages}
+        return results
+
+    async def events(self):
+        """GET /api/events with many events, each with memories."""
+        count = 200 if self.quick else 1000
+        server = self.server
+        now = datetime.now(timezone.utc)
+        await server.db.events.insert_many([
+            {"id": str(uuid.uuid4()), "name": f"Event {i}", "couple_names": "A & B", "code": f"E{i:06d}",
+             "is_active": True, "created_at": (now - timedelta(minutes=i)).isoformat()}
+            for i in range(count)
+        ])
+        latencies = []
+        for _ in range(20):
+            start = time.perf_counter()
+            (await self.client.get("/api/events")).raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        return {"events": count, **percentiles(latencies)}
+
+    async def pdf(self):
+        """download_event_memories_pdf by event size and photo resolution,
+        with a cold and then a warm page cache."""
+        from page_cache import PageCache
+        results = {}
+        sizes, edges = ((10, 40), (1024, 3000)) if self.quick else ((10, 50, 200), (1024, 2048, 4000))
+        for edge in edges:
+            for size in sizes:
+                event = await self.create_event(f"PDF {size}x{edge}")
+                await self.seed_memories(event["id"], size, photo_edge=edge)
+                self.server.page_cache = PageCache(tempfile.mkdtemp(prefix="bench-pages-"), max_bytes=1 << 30)
+                run = {}
+                for label in ("cold", "warm"):
+                    with RssSampler() as rss:
+                        start = time.perf_counter()
+                        response = await self.client.get(f"/api/events/{event['id']}/pdf")
+                        response.raise_for_status()
+                        run[label] = {"seconds": round(time.perf_counter() - start, 3),
+                                      "bytes": len(response.content), "peak_rss_mb": rss.peak_mb}
+                results[f"{size}_pages_{edge}px"] = run
+        return results
+
+
+def import_profile(top=15):
+    """``import server`` under ``python -X importtime``: total time, the
+    slowest direct imports, and whether the PDF and image libraries loaded."""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import server"], cwd=ROOT_DIR,
+                            capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode:
+        return {"error": result.stderr.strip().splitlines()[-1]}
+    total, direct, loaded = None, [], set()
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if not line.startswith("import time:") or len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2][1:]
+        module = name.strip()
+        loaded.add(module)
+        # Indentation is nesting depth; children are listed before their parent
+        depth = (len(name) - len(module)) // 2
+        if depth == 1:
+            direct.append((int(fields[1]), module))
+        elif depth == 0 and module == "server":
+            total = int(fields[1])
+    return {
+        "server_ms": round(total / 1000, 1) if total else None,
+        "process_ms": round(wall * 1000, 1),
+        "slowest": [{"module": module, "cumulative_ms": round(us / 1000, 1)}
+                    for us, module in sorted(direct, reverse=True)[:top]],
+        "heavy_loaded": sorted(name for name in ("reportlab", "PIL", "pdf_book") if name in loaded),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="memora-bench-")
+    db_name = f"memora_bench_{uuid.uuid4().hex[:8]}"
+    os.environ["MONGO_URL"] = args.mongo_url or "mongodb://localhost:27017"
+    os.environ["DB_NAME"] = db_name
+    for name in ("BLOB_DIR", "EXPORT_DIR", "PAGE_CACHE_DIR"):
+        os.environ[name] = os.path.join(workdir, name.lower())
+    sys.path.insert(0, str(ROOT_DIR))
+    imports = import_profile()
+
+    import httpx
+    import server
+    if args.mongo_url:
+        mongo = server.connect_mongo()
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("mongomock-motor is required without --mongo-url: pip install mongomock-motor")
+        mongo = AsyncMongoMockClient()
+    # The ASGI transport does not run the app's lifespan
+    server.bind_database(mongo[db_name])
+    await server.ensure_indexes(server.db)
+    await server.init_settings()
+
+    results = {}
+    transport = httpx.ASGITransport(app=server.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            bench = Bench(server, client, args.quick)
+            for name in args.only:
+                print(f"Running {name}...", file=sys.stderr)
+                start = time.perf_counter()
+                results[name] = await getattr(bench, name)()
+                results[name]["scenario_seconds"] = round(time.perf_counter() - start, 3)
+    finally:
+        if args.mongo_url:
+            await mongo.drop_database(db_name)
+            mongo.close()
+        server.shutdown_pdf_workers()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "database": "mongod" if args.mongo_url else "mongomock",
+        "quick": args.quick,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "imports": imports,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", help="benchmark against this MongoDB instead of mongomock")
+    parser.add_argument("--only", default=",".join(SCENARIOS), help="comma-separated scenarios")
+    parser.add_argument("--quick", action="store_true", help="smaller data sets")
+    parser.add_argument("--output", default="benchmark-results.json")
+    args = parser.parse_args()
+    args.only = [name for name in args.only.split(",") if name]
+    unknown = set(args.only) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = asyncio.run(run(args))
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(json.dumps({"imports": report["imports"], **report["results"]}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
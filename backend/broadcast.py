@@ -0,0 +1,75 @@
+"""Cache invalidation and feed broadcast between worker processes on one host.
+
+A local stand-in for a pub/sub server: every worker binds a Unix datagram
+socket in a shared directory and ``publish`` sends the message to every
+other socket found there. Sockets left behind by dead workers are removed
+when a send to them is refused. Delivery is best effort; a dropped
+invalidation leaves a stale entry until the cache TTL expires it, a dropped
+feed delta is missing from the other workers' feeds until their clients
+refetch.
+
+On platforms without Unix sockets the broadcast is a no-op, which is correct
+for a single process.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBroadcast:
+    def __init__(self, channel_dir, on_message):
+        self.channel_dir = Path(channel_dir)
+        self.on_message = on_message
+        self.path = None
+        self.sock = None
+
+    def start(self):
+        if not hasattr(socket, "AF_UNIX"):
+            return
+        self.channel_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.channel_dir / f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock"
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(str(self.path))
+        self.sock.setblocking(False)
+        asyncio.get_running_loop().add_reader(self.sock.fileno(), self._receive)
+
+    def publish(self, message):
+        if self.sock is None:
+            return
+        data = json.dumps(message).encode()
+        for peer in self.channel_dir.glob("*.sock"):
+            if peer == self.path:
+                continue
+            try:
+                self.sock.sendto(data, str(peer))
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Its worker is gone
+                peer.unlink(missing_ok=True)
+            except BlockingIOError:
+                logger.warning("Dropped broadcast message for %s, its queue is full", peer.name)
+
+    def _receive(self):
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                return
+            try:
+                self.on_message(json.loads(data))
+            except Exception:
+                logger.exception("Bad broadcast message")
+
+    def stop(self):
+        if self.sock is None:
+            return
+        asyncio.get_running_loop().remove_reader(self.sock.fileno())
+        self.sock.close()
+        self.sock = None
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,79 @@
+"""Small in-process async cache for hot, rarely changing documents.
+
+Entries expire after a TTL (never if it is None) and the least recently used
+entry is evicted once ``maxsize`` is reached. Concurrent misses for the same key share a single
+load, so a burst of guests opening the same event costs one database read.
+Writers call ``invalidate`` (or ``invalidate_where``) after changing the
+underlying document. Cached values are shared between callers and must be
+treated as read-only.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class AsyncTTLCache:
+    def __init__(self, maxsize=1024, ttl=30.0, cache_none=False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.cache_none = cache_none
+        self._entries = OrderedDict()
+        self._loading = {}
+        # Bumped by every invalidation so loads that started before it do
+        # not store a value that may already be stale
+        self._generation = 0
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _store(self, key, value):
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def get_or_load(self, key, loader):
+        """Return the cached value for ``key``, awaiting ``loader()`` on a miss."""
+        hit, value = self._lookup(key)
+        if hit:
+            return value
+        pending = self._loading.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._load(key, loader, self._generation))
+            self._loading[key] = pending
+        # shield so one cancelled caller does not cancel the shared load
+        return await asyncio.shield(pending)
+
+    async def _load(self, key, loader, generation):
+        # ``generation`` is taken when the load is scheduled, before this
+        # task first runs, so an invalidation in between is not missed
+        try:
+            value = await loader()
+            if generation == self._generation and (value is not None or self.cache_none):
+                self._store(key, value)
+            return value
+        finally:
+            self._loading.pop(key, None)
+
+    def invalidate(self, key):
+        self._generation += 1
+        self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Drop every entry for which ``predicate(key, value)`` is true."""
+        self._generation += 1
+        for key in [k for k, (_, v) in self._entries.items() if predicate(k, v)]:
+            del self._entries[key]
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
@@ -0,0 +1,230 @@
+"""Background PDF export jobs with progress tracking and cached artifacts.
+
+A job renders an event's book to a file under the export directory while the
+client polls for progress. The finished artifact is keyed by a version of the
+event's memories (newest ``created_at`` plus count), the book's title, the
+export profile and the renderer's ``PAGE_RENDER_VERSION``, so asking again
+before anything changed returns the existing book immediately. Job state
+lives in the ``export_jobs`` collection so any worker can report on it.
+
+Exactly one job per version is ``active``: a unique index over active jobs
+lets only one worker claim a version, and a job gives up the claim when it
+fails or is found abandoned.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import anyio
+from fastapi.responses import Response, StreamingResponse
+from pymongo.errors import DuplicateKeyError
+
+from export_profiles import PAGE_RENDER_VERSION, PROFILES
+
+
+logger = logging.getLogger(__name__)
+
+# A queued or running job whose heartbeat is older than this is assumed dead
+# (for example because its worker restarted) and may be started again
+STALE_AFTER_SECONDS = 120
+HEARTBEAT_SECONDS = 30
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class ExportJobManager:
+    def __init__(self, db, export_dir, concurrency=2):
+        self.db = db
+        self.export_dir = Path(export_dir)
+        self.export_dir.mkdir(parents=True, exist_ok=True)
+        self.slots = asyncio.Semaphore(concurrency)
+        self.tasks = set()
+
+    async def event_version(self, event_id, title, profile=None):
+        """Return ``(version, memory_count)`` for the event's current memories
+        exported as a book titled ``title`` with ``profile``."""
+        pipeline = [
+            {"$match": {"event_id": event_id}},
+            {"$group": {"_id": None, "last": {"$max": "$created_at"}, "count": {"$sum": 1}}},
+        ]
+        result = await self.db.memories.aggregate(pipeline).to_list(1)
+        last, count = (str(result[0]["last"]), result[0]["count"]) if result else ("", 0)
+        key = [PAGE_RENDER_VERSION, event_id, last, count, title, profile, PROFILES.get(profile)]
+        version = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+        return version, count
+
+    def artifact_path(self, event_id, version, profile=None):
+        if profile:
+            return self.export_dir / f"{event_id}-{profile}-{version}.pdf"
+        return self.export_dir / f"{event_id}-{version}.pdf"
+
+    async def cached_artifact(self, event_id, title, profile=None):
+        """Return ``(path, version)`` of an up-to-date book for the event, if any."""
+        version, _ = await self.event_version(event_id, title, profile)
+        path = self.artifact_path(event_id, version, profile)
+        return (path, version) if path.exists() else (None, version)
+
+    async def start(self, event_id, make_pages, render, title, profile=None):
+        """Return the job for the event's current version, starting one if needed.
+
+        ``make_pages()`` returns a fresh async iterable of book pages and
+        ``render(pages, title, progress)`` the async iterable of PDF bytes.
+        """
+        version, total = await self.event_version(event_id, title, profile)
+        job = await self.db.export_jobs.find_one(
+            {"event_id": event_id, "version": version, "active": True}, {"_id": 0}
+        )
+        if job and job["status"] == "done" and self.artifact_path(event_id, version, profile).exists():
+            return job
+        if job and job["status"] != "done" and not _is_stale(job):
+            return job
+        if job:
+            # Abandoned, or its book was removed; only one caller retires it
+            retire = {"$unset": {"active": ""}}
+            if job["status"] != "done":
+                retire["$set"] = {"status": "failed", "error": "Abandoned"}
+            await self.db.export_jobs.update_one({"id": job["id"], "updated_at": job["updated_at"]}, retire)
+
+        now = datetime.now(timezone.utc).isoformat()
+        job = {
+            "id": str(uuid.uuid4()),
+            "event_id": event_id,
+            "version": version,
+            "profile": profile,
+            "status": "queued",
+            "pages_done": 0,
+            "pages_total": total,
+            "size": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "active": True,
+        }
+        try:
+            await self.db.export_jobs.insert_one(dict(job))
+        except DuplicateKeyError:
+            # Another request or worker claimed this version first
+            claimed = await self.db.export_jobs.find_one(
+                {"event_id": event_id, "version": version, "active": True}, {"_id": 0}
+            )
+            if claimed:
+                return claimed
+            raise
+        task = asyncio.create_task(self._run(job, make_pages, render, title))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return job
+
+    async def get(self, job_id):
+        return await self.db.export_jobs.find_one({"id": job_id}, {"_id": 0})
+
+    async def _update(self, job, **fields):
+        fields["updated_at"] = datetime.now(timezone.utc).isoformat()
+        job.update(fields)
+        update = {"$set": fields}
+        if fields.get("status") == "failed":
+            job.pop("active", None)
+            update["$unset"] = {"active": ""}
+        await self.db.export_jobs.update_one({"id": job["id"]}, update)
+
+    async def _heartbeat(self, job):
+        # Keeps a job that waits for a slot or renders a slow page from
+        # looking abandoned
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            await self._update(job)
+
+    async def _run(self, job, make_pages, render, title):
+        path = self.artifact_path(job["event_id"], job["version"], job.get("profile"))
+        # Per job, so a job taking over an abandoned one never shares its file
+        partial = path.with_name(f"{path.stem}.{job['id']}.part")
+        loop = asyncio.get_running_loop()
+        progress_updates = set()
+
+        def progress(pages_done):
+            # Called from the render loop; persist without blocking it
+            update = loop.create_task(self._update(job, pages_done=pages_done))
+            progress_updates.add(update)
+            update.add_done_callback(progress_updates.discard)
+
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            async with self.slots:
+                try:
+                    await self._update(job, status="running")
+                    async with await anyio.open_file(partial, "wb") as out:
+                        async for chunk in render(make_pages(), title, progress):
+                            await out.write(chunk)
+                    if progress_updates:
+                        await asyncio.gather(*progress_updates)
+                    os.replace(partial, path)
+                    await self._update(job, status="done", pages_done=job["pages_total"], size=path.stat().st_size)
+                    self._remove_stale_artifacts(job["event_id"], job.get("profile"), keep=path)
+                except Exception as e:
+                    logger.exception("Export job %s failed", job["id"])
+                    partial.unlink(missing_ok=True)
+                    await self._update(job, status="failed", error=str(e))
+        finally:
+            heartbeat.cancel()
+
+    def _remove_stale_artifacts(self, event_id, profile, keep):
+        pattern = f"{event_id}-{profile}-*.pdf" if profile else f"{event_id}-*.pdf"
+        for old in self.export_dir.glob(pattern):
+            if old != keep:
+                old.unlink(missing_ok=True)
+
+    async def shutdown(self):
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+def _is_stale(job):
+    updated = datetime.fromisoformat(job["updated_at"])
+    return (datetime.now(timezone.utc) - updated).total_seconds() > STALE_AFTER_SECONDS
+
+
+def file_response(path, range_header=None, filename=None, etag=None, media_type="application/pdf", chunk_size=64 * 1024):
+    """Serve ``path`` honouring a single ``Range: bytes=`` request."""
+    size = os.path.getsize(path)
+    headers = {"Accept-Ranges": "bytes"}
+    if filename:
+        headers["Content-Disposition"] = f"attachment; filename={filename}"
+    if etag:
+        headers["ETag"] = f'"{etag}"'
+
+    start, end = 0, size - 1
+    status_code = 200
+    match = _RANGE_RE.match(range_header or "")
+    if match and (match.group(1) or match.group(2)):
+        if match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size - int(match.group(2)), 0)
+        if start > end or start >= size:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    async def body():
+        async with await anyio.open_file(path, "rb") as f:
+            await f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = await f.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+
+    return StreamingResponse(body(), status_code=status_code, media_type=media_type, headers=headers)
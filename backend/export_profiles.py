@@ -0,0 +1,32 @@
+"""Quality profiles for PDF book exports.
+
+``dpi`` is the resolution photos are embedded at for their printed size and
+picks the smallest stored rendition covering it; None embeds the original
+uploads untouched. Other photos are embedded as RGB JPEGs: with
+``resample`` a photo larger than ``dpi`` calls for is downsampled and
+re-encoded at ``quality``, otherwise only photos that are not already RGB
+JPEGs are re-encoded.
+"""
+
+PROFILES = {
+    # Previews on phones and screens
+    "screen": {"dpi": 150, "resample": True, "quality": 75},
+    "print": {"dpi": 300, "resample": False, "quality": 90},
+    # What the guests uploaded, for keeping
+    "archive": {"dpi": None},
+}
+
+DEFAULT_PROFILE = "print"
+
+# Bump whenever draw_page output, a LAYOUTS entry or a PAGE_TEMPLATES entry
+# changes, so cached pages and finished books are rendered again. Kept here
+# rather than in pdf_book so export jobs can key their books without
+# loading reportlab.
+PAGE_RENDER_VERSION = 4
+
+
+def photo_edge(profile: str, size: float):
+    """Pixels a photo printed ``size`` points wide needs under ``profile``,
+    or None for originals."""
+    dpi = PROFILES[profile]["dpi"]
+    return round(size / 72 * dpi) if dpi else None
@@ -0,0 +1,176 @@
+"""Per-event push feed of memory changes for the admin page and slideshow.
+
+Subscribers receive small deltas (``type``, ``id``, ``guest_name``,
+``thumb``, ``created_at``) instead of polling the full memory list. Each delta
+carries a resume token; a reconnecting client passes back the last one it saw
+and gets only what it missed. When the missed changes can no longer be
+replayed the client receives a ``reset`` delta and should refetch the list.
+
+Two backends share one interface:
+
+* ``LocalFeed`` (default) is an in-process pub/sub fed by the API handlers,
+  with a short replay history per event. Given a ``relay``, it hands every
+  delta it publishes to it, and ``deliver`` takes the deltas other workers
+  relayed, so every worker's subscribers see every worker's changes. Resume
+  tokens are per process; a client reconnecting to another worker gets a
+  ``reset``.
+* ``ChangeStreamFeed`` watches the ``memories`` collection through MongoDB
+  change streams (replica sets only), so it sees changes from every worker,
+  and uses the change stream's own resume tokens.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from collections import deque
+
+from pymongo.errors import OperationFailure
+
+
+logger = logging.getLogger(__name__)
+
+RESET = {"type": "reset"}
+
+
+class LocalFeed:
+    def __init__(self, make_delta, relay=None, history=256, queue_size=256, heartbeat=15.0):
+        self.make_delta = make_delta
+        self.relay = relay
+        self.history_size = history
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        # Tokens from a previous process cannot be replayed
+        self.boot = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.history = {}
+        # event_id -> seq of the newest delta dropped from its history
+        self.evicted = {}
+        self.subscribers = {}
+
+    async def setup(self):
+        pass
+
+    def publish(self, kind, memory):
+        event_id = memory.get('event_id')
+        if not event_id:
+            return
+        delta = self.make_delta(kind, memory)
+        self.deliver(event_id, delta)
+        if self.relay:
+            self.relay(event_id, delta)
+
+    def deliver(self, event_id, delta):
+        """Pass ``delta`` to the event's subscribers and replay history."""
+        self.seq += 1
+        item = (self.seq, delta)
+        ring = self.history.setdefault(event_id, deque(maxlen=self.history_size))
+        if len(ring) == ring.maxlen:
+            self.evicted[event_id] = ring[0][0]
+        ring.append(item)
+        for queue in self.subscribers.get(event_id, ()):
+            try:
+                queue.put_nowait(item)
+            except asyncio.QueueFull:
+                # Too slow; end its stream so it reconnects and replays
+                queue.overflowed = True
+
+    def _token(self, seq):
+        return f"{self.boot}-{seq}"
+
+    def _parse_token(self, token):
+        boot, _, seq = (token or "").partition("-")
+        if boot != self.boot or not seq.isdigit():
+            return None
+        return int(seq)
+
+    async def subscribe(self, event_id, last_token=None):
+        """Yield ``(token, delta)`` pairs, or None after ``heartbeat`` idle seconds."""
+        queue = asyncio.Queue(self.queue_size)
+        queue.overflowed = False
+        self.subscribers.setdefault(event_id, set()).add(queue)
+        try:
+            # Registering and snapshotting the history happen without an
+            # await in between, so the queue only holds newer deltas
+            if last_token:
+                since = self._parse_token(last_token)
+                if since is None or since > self.seq or since < self.evicted.get(event_id, 0):
+                    yield self._token(self.seq), RESET
+                else:
+                    for seq, delta in list(self.history.get(event_id, ())):
+                        if seq > since:
+                            yield self._token(seq), delta
+            while not queue.overflowed:
+                try:
+                    seq, delta = await asyncio.wait_for(queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield self._token(seq), delta
+        finally:
+            self.subscribers[event_id].discard(queue)
+            if not self.subscribers[event_id]:
+                del self.subscribers[event_id]
+
+
+class ChangeStreamFeed:
+    def __init__(self, collection, make_delta, heartbeat=15.0):
+        self.collection = collection
+        self.make_delta = make_delta
+        self.heartbeat = heartbeat
+
+    async def setup(self):
+        # Let change streams see the document a delete removed
+        try:
+            await self.collection.database.command(
+                {"collMod": self.collection.name, "changeStreamPreAndPostImages": {"enabled": True}}
+            )
+        except OperationFailure as e:
+            logger.warning("Could not enable change stream pre-images: %s", e)
+
+    def publish(self, kind, memory):
+        # The change stream reports writes by itself
+        pass
+
+    async def subscribe(self, event_id, last_token=None):
+        match = {"$match": {"$or": [
+            {"fullDocument.event_id": event_id},
+            # Deletes only carry the document when pre-images are enabled
+            {"fullDocumentBeforeChange.event_id": event_id},
+        ]}}
+        options = {
+            "full_document": "updateLookup",
+            "full_document_before_change": "whenAvailable",
+            "max_await_time_ms": int(self.heartbeat * 1000),
+        }
+        resume_after = {"_data": last_token} if last_token else None
+        try:
+            stream = self.collection.watch([match], resume_after=resume_after, **options)
+            change = await stream.try_next()
+            reset = False
+        except OperationFailure:
+            # Token malformed or already gone from the oplog
+            await stream.close()
+            stream = self.collection.watch([match], **options)
+            change = await stream.try_next()
+            reset = True
+        async with stream:
+            if reset:
+                yield stream.resume_token["_data"], RESET
+            while True:
+                if change is None:
+                    yield None
+                else:
+                    kind = {"insert": "created", "delete": "deleted"}.get(change["operationType"], "updated")
+                    memory = change.get("fullDocument") or change.get("fullDocumentBeforeChange")
+                    if memory:
+                        yield change["_id"]["_data"], self.make_delta(kind, memory)
+                if not stream.alive:
+                    break
+                change = await stream.try_next()
+
+
+def get_memory_feed(db, make_delta, relay=None):
+    backend = os.environ.get("FEED_BACKEND", "local").lower()
+    if backend == "changestream":
+        return ChangeStreamFeed(db.memories, make_delta)
+    return LocalFeed(make_delta, relay)
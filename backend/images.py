@@ -0,0 +1,141 @@
+"""Upload-time image pipeline producing fixed-size photo renditions.
+
+Every guest photo is decoded once, rotated according to its EXIF orientation,
+stripped of metadata and re-encoded into a small set of renditions. Readers
+then pick the smallest rendition that covers the pixels they need instead of
+decoding the camera original again.
+
+Pillow is imported on the first decode rather than with this module, so a
+worker pays for it only once it handles a photo.
+"""
+import asyncio
+from io import BytesIO
+
+import metrics
+
+
+# name -> (longest edge in px, encoder format, encoder options)
+RENDITIONS = {
+    "thumb": (320, "WEBP", {"quality": 75, "method": 4}),
+    # JPEG so the PDF renderer can embed these without re-encoding
+    "preview": (1024, "JPEG", {"quality": 85, "optimize": True}),
+    "print": (2048, "JPEG", {"quality": 88, "optimize": True}),
+}
+
+# Page backgrounds, sized for phones, tablets and desktop screens
+BACKGROUND_RENDITIONS = {
+    "small": (640, "JPEG", {"quality": 80, "optimize": True, "progressive": True}),
+    "medium": (1280, "JPEG", {"quality": 80, "optimize": True, "progressive": True}),
+    "large": (1920, "JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def warm_up():
+    """Import Pillow and register its decoders ahead of the first upload."""
+    from PIL import Image
+    Image.init()
+
+
+def normalise(data, max_edge: int = None) -> "Image.Image":
+    """Decode ``data`` (bytes or a file path) upright and in RGB."""
+    from PIL import Image, ImageOps
+    try:
+        img = Image.open(BytesIO(data) if isinstance(data, bytes) else data)
+        if max_edge:
+            # Lets the JPEG decoder scale down by up to 8x while decoding, so
+            # a large camera photo is never fully expanded in memory
+            img.draft("RGB", (max_edge, max_edge))
+        img.load()
+    except Exception as e:
+        raise InvalidImage(str(e))
+    img = ImageOps.exif_transpose(img)
+    if img.mode in ("RGBA", "LA", "P"):
+        # Flatten transparency onto white, matching the printed page
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    return img.convert("RGB")
+
+
+def render(data, specs: dict = RENDITIONS) -> dict:
+    """Return ``{name: (encoded bytes, width, height)}`` for every rendition.
+
+    Encoding from a fresh image drops EXIF, GPS and ICC metadata.
+    """
+    from PIL import Image
+    with metrics.image_decode_duration.time():
+        img = normalise(data, max(edge for edge, _, _ in specs.values()))
+    renditions = {}
+    # Largest first so each smaller rendition is downsampled from the previous one
+    source = img
+    for name, (edge, fmt, options) in sorted(specs.items(), key=lambda r: -r[1][0]):
+        resized = source.copy()
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        buffer = BytesIO()
+        resized.save(buffer, fmt, **options)
+        renditions[name] = (buffer.getvalue(), resized.width, resized.height)
+        source = resized
+    return renditions
+
+
+def as_rgb_jpeg(data: bytes, max_edge: int = None, quality: int = 90) -> bytes:
+    """Return ``data`` as an RGB JPEG at most ``max_edge`` pixels on its
+    longest side, unchanged if it already is one."""
+    from PIL import Image
+    try:
+        with Image.open(BytesIO(data)) as img:
+            if img.format == "JPEG" and img.mode == "RGB" and (not max_edge or max(img.size) <= max_edge):
+                return data
+    except Exception as e:
+        raise InvalidImage(str(e))
+    img = normalise(data, max_edge)
+    if max_edge:
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    buffer = BytesIO()
+    img.save(buffer, "JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+async def store_photo(blob_store, data: bytes, specs: dict = RENDITIONS) -> tuple:
+    """Store the original and its renditions; return ``(photo_key, renditions)``.
+
+    ``renditions`` maps each rendition name to ``{"key", "width", "height"}``.
+    """
+    rendered = await asyncio.to_thread(render, data, specs)
+    photo_key = await blob_store.put(data)
+    return photo_key, await _store_renditions(blob_store, rendered)
+
+
+async def store_upload(blob_store, writer, specs: dict = RENDITIONS) -> tuple:
+    """Like ``store_photo`` for an upload spooled by a ``BlobWriter``.
+
+    The renditions are rendered from the spooled file before it is committed,
+    so an upload that is not a decodable image is never stored.
+    """
+    rendered = await asyncio.to_thread(render, writer.path, specs)
+    photo_key = await writer.commit()
+    return photo_key, await _store_renditions(blob_store, rendered)
+
+
+async def _store_renditions(blob_store, rendered: dict) -> dict:
+    renditions = {}
+    for name, (encoded, width, height) in rendered.items():
+        renditions[name] = {"key": await blob_store.put(encoded), "width": width, "height": height}
+    return renditions
+
+
+def pick_rendition(renditions: dict, min_edge: int):
+    """Return the key of the smallest rendition whose longest edge is at least
+    ``min_edge`` pixels, falling back to the largest one available."""
+    if not renditions:
+        return None
+    ordered = sorted(renditions.values(), key=lambda r: max(r["width"], r["height"]))
+    for rendition in ordered:
+        if max(rendition["width"], rendition["height"]) >= min_edge:
+            return rendition["key"]
+    return ordered[-1]["key"]
@@ -0,0 +1,89 @@
+"""MongoDB index declarations, created at startup.
+
+Every hot query in server.py is backed by one of these indexes. Creating an
+index that already exists is a no-op, so ``ensure_indexes`` is safe to run on
+every start; indexes that cannot be built (for example a unique index over
+existing duplicates) are logged and reported instead of failing startup.
+"""
+import logging
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    "events": [
+        # Guest lookups by code; the partial filter lets a code be reused once
+        # its event is deactivated, and uniqueness replaces the retry loop
+        # create_event used to run against the collection
+        IndexModel([("code", ASCENDING)], name="code_active_unique", unique=True,
+                   partialFilterExpression={"is_active": True}),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Admin dashboard: active events, newest first
+        IndexModel([("is_active", ASCENDING), ("created_at", DESCENDING)], name="active_created_at"),
+    ],
+    "memories": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True,
+                   partialFilterExpression={"id": {"$type": "string"}}),
+        # Event listings, cursor pagination, PDF books and event statistics
+        IndexModel([("event_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+                   name="event_created_at_id"),
+        # Listings across all events
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+    ],
+    "event_views": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # The guest's lookup by event code
+        IndexModel([("code", ASCENDING)], name="code"),
+    ],
+    "settings": [
+        # Lets concurrent workers seed the settings document only once
+        IndexModel([("singleton", ASCENDING)], name="singleton_unique", unique=True,
+                   partialFilterExpression={"singleton": {"$exists": True}}),
+    ],
+    "export_jobs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # One queued, running or finished job per version, across workers;
+        # also serves the lookup of a version's job, which is always by active
+        IndexModel([("event_id", ASCENDING), ("version", ASCENDING)], name="event_version_active_unique",
+                   unique=True, partialFilterExpression={"active": True}),
+    ],
+}
+
+# Indexes earlier releases created that are dropped before creating the above,
+# by collection
+RETIRED_INDEXES = {
+    # Superseded by event_version_active_unique, which has the same keys
+    "export_jobs": ["event_version"],
+}
+
+
+async def ensure_indexes(db):
+    """Create all declared indexes and return the names of any still missing."""
+    for collection, names in RETIRED_INDEXES.items():
+        existing = await db[collection].index_information()
+        for name in names:
+            if name in existing:
+                await db[collection].drop_index(name)
+                logger.info("Dropped retired index %s.%s", collection, name)
+    for collection, models in INDEXES.items():
+        for model in models:
+            try:
+                await db[collection].create_indexes([model])
+            except OperationFailure as e:
+                logger.error("Could not create index %s.%s: %s", collection, model.document["name"], e)
+    missing = await missing_indexes(db)
+    for name in missing:
+        logger.warning("Missing index %s", name)
+    return missing
+
+
+async def missing_indexes(db):
+    missing = []
+    for collection, models in INDEXES.items():
+        existing = await db[collection].index_information()
+        missing.extend(f"{collection}.{model.document['name']}" for model in models
+                       if model.document["name"] not in existing)
+    return missing
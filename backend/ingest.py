@@ -0,0 +1,203 @@
+"""Write-behind ingestion of guest memories for submission bursts.
+
+``IngestQueue.submit`` appends the memory to an on-disk journal and returns
+once the journal is fsynced, so an acknowledged submission survives a crash.
+Concurrent submissions share one write and fsync (group commit). A background
+task flushes queued memories with ``insert_many`` once ``batch_size`` of them
+are waiting or ``max_delay`` seconds passed, then hands each inserted batch to
+``after_insert`` (bulk counter updates and feed notifications).
+
+At most ``maxsize`` memories are queued; further submissions wait up to
+``enqueue_timeout`` seconds for room and then fail with ``IngestQueueFull``.
+``close`` drains the queue. Journal segments of a process that died before
+flushing are replayed by the next ``start``; memories already inserted are
+skipped by their unique ``id``.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+class IngestQueue:
+    def __init__(self, collection, journal_dir, after_insert=None, batch_size=200, max_delay=0.2,
+                 maxsize=5000, enqueue_timeout=2.0):
+        self.collection = collection
+        self.journal_dir = Path(journal_dir)
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        self.after_insert = after_insert
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.enqueue_timeout = enqueue_timeout
+        # Segment names carry the pid so start() can tell abandoned ones
+        self.prefix = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.segment_number = 0
+        self.segment = None
+        self.sealed = []
+        self.slots = asyncio.Semaphore(maxsize)
+        self.journal_lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+        self.to_journal = []
+        self.journal_task = None
+        self.buffer = []
+        self.flusher = None
+        self.closing = False
+
+    async def start(self):
+        await self._replay_abandoned()
+        self._open_segment()
+        self.flusher = asyncio.create_task(self._run())
+
+    async def submit(self, doc):
+        """Queue ``doc`` for insertion; returns once it is durably journaled."""
+        if self.closing or self.flusher is None:
+            raise IngestQueueFull("Ingest queue is not accepting submissions")
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            raise IngestQueueFull("Ingest queue is full")
+        future = asyncio.get_running_loop().create_future()
+        self.to_journal.append((doc, future))
+        if self.journal_task is None or self.journal_task.done():
+            self.journal_task = asyncio.create_task(self._write_journal())
+        await future
+
+    async def _write_journal(self):
+        while self.to_journal:
+            pending, self.to_journal = self.to_journal, []
+            lines = b"".join(json.dumps(doc, default=str).encode() + b"\n" for doc, _ in pending)
+            async with self.journal_lock:
+                try:
+                    await asyncio.to_thread(_append_fsync, self.segment, lines)
+                except OSError as e:
+                    for _, future in pending:
+                        self.slots.release()
+                        future.set_exception(e)
+                    continue
+                self.buffer.extend(doc for doc, _ in pending)
+            for _, future in pending:
+                future.set_result(None)
+            if len(self.buffer) >= self.batch_size:
+                self.wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            flushed = await self._flush()
+            if self.closing and (not flushed or not (self.buffer or self.to_journal)):
+                # Anything left over stays journaled for the next start
+                return
+            if not flushed:
+                # Database unavailable; the journal keeps the submissions
+                await asyncio.sleep(1)
+
+    async def _flush(self):
+        async with self.journal_lock:
+            items, self.buffer = self.buffer, []
+            if not items:
+                return True
+            # Everything journaled so far is in items; later submissions go
+            # to a new segment
+            self.sealed.append(self.segment)
+            self._open_segment()
+        for start in range(0, len(items), self.batch_size):
+            try:
+                await self._insert(items[start:start + self.batch_size])
+            except PyMongoError as e:
+                logger.error("Ingest flush failed, will retry: %s", e)
+                self.buffer[:0] = items[start:]
+                return False
+            for _ in items[start:start + self.batch_size]:
+                self.slots.release()
+        sealed, self.sealed = self.sealed, []
+        await asyncio.to_thread(_remove, sealed)
+        return True
+
+    async def _insert(self, docs):
+        try:
+            await self.collection.insert_many(docs, ordered=False)
+            inserted = docs
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details.get("writeErrors", ())}
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", ())):
+                logger.error("Ingest batch had write errors: %s", e.details.get("writeErrors"))
+            # Duplicates were inserted by an earlier attempt
+            inserted = [doc for index, doc in enumerate(docs) if index not in failed]
+        if inserted and self.after_insert:
+            try:
+                await self.after_insert(inserted)
+            except Exception:
+                logger.exception("Ingest after_insert failed")
+
+    async def _replay_abandoned(self):
+        segments = [path for path in sorted(self.journal_dir.glob("*.ndjson"))
+                    if not _pid_alive(int(path.name.split("-", 1)[0]))]
+        for path in segments:
+            # Workers starting together see the same segments; renaming one
+            # to a name under this process's pid claims it, and a segment
+            # left claimed by a worker that died is replayed like any other
+            claimed = path.with_name(f"{self.prefix}-replay-{path.name}")
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            docs = [json.loads(line) for line in claimed.read_bytes().splitlines() if line.strip()]
+            for start in range(0, len(docs), self.batch_size):
+                await self._insert(docs[start:start + self.batch_size])
+            claimed.unlink(missing_ok=True)
+            logger.info("Replayed %d journaled memories from %s", len(docs), path.name)
+
+    def _open_segment(self):
+        self.segment_number += 1
+        self.segment = self.journal_dir / f"{self.prefix}-{self.segment_number:06d}.ndjson"
+
+    async def close(self):
+        """Stop accepting submissions and flush everything queued."""
+        self.closing = True
+        if self.journal_task:
+            await self.journal_task
+        if self.flusher:
+            self.wakeup.set()
+            await self.flusher
+
+
+def _append_fsync(path, data):
+    with open(path, "ab") as journal:
+        journal.write(data)
+        journal.flush()
+        os.fsync(journal.fileno())
+
+
+def _remove(paths):
+    for path in paths:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,185 @@
+"""Load generator replaying the wedding guest flow against a running server.
+
+    python loadtest.py --base-url http://localhost:8001 --curve burst --peak-rate 20 --duration 120
+
+Guests arrive as a Poisson process whose rate follows the arrival curve:
+
+* ``constant``: ``--peak-rate`` guests per second throughout;
+* ``ramp``: rising linearly from zero to ``--peak-rate``;
+* ``burst``: a tenth of the peak rate, with the peak in the middle fifth of
+  the run (guests submitting right after the ceremony).
+
+Each guest opens the event by code, loads the settings, thinks for a moment,
+asks for a question and submits a memory with a camera-sized photo.
+Meanwhile ``--admins`` clients poll the event's memory listing and one
+exports the PDF book every ``--pdf-interval`` seconds. The report gives throughput, error rate and
+latency percentiles per endpoint, and is also written as JSON.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+from benchmark import percentiles, photo_bytes
+
+
+CURVES = ("constant", "ramp", "burst")
+
+
+def arrival_rate(curve, peak, elapsed, duration):
+    if curve == "ramp":
+        return peak * elapsed / duration
+    if curve == "burst":
+        return peak if 0.4 <= elapsed / duration < 0.6 else peak / 10
+    return peak
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, client, name, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            response, failed = None, True
+        self.latencies[name].append(time.perf_counter() - start)
+        if failed:
+            self.errors[name] += 1
+        return response
+
+    def report(self, elapsed):
+        return {
+            name: {
+                "requests": len(samples),
+                "errors": self.errors[name],
+                "error_rate": round(self.errors[name] / len(samples), 4),
+                "throughput_rps": round(len(samples) / elapsed, 2),
+                **percentiles(samples),
+            }
+            for name, samples in sorted(self.latencies.items())
+        }
+
+
+async def guest(client, recorder, event, photos, json_submit):
+    await recorder.call(client, "GET /api/events/code/{code}", "GET", f"/api/events/code/{event['code']}")
+    await recorder.call(client, "GET /api/settings", "GET", "/api/settings")
+    # Choosing a tone, taking the photo and writing the message
+    await asyncio.sleep(random.uniform(1, 5))
+    await recorder.call(client, "GET /api/questions/random", "GET", "/api/questions/random",
+                        params={"tone": "wise", "event_code": event["code"]})
+    photo = random.choice(photos)
+    fields = {"event_code": event["code"], "guest_name": "Load Test Guest",
+              "message": "Wishing you both a lifetime of happiness!", "tone": "heartfelt"}
+    if json_submit:
+        import base64
+        fields["photo"] = "data:image/jpeg;base64," + base64.b64encode(photo).decode()
+        await recorder.call(client, "POST /api/memories", "POST", "/api/memories", json=fields)
+    else:
+        await recorder.call(client, "POST /api/memories/upload", "POST", "/api/memories/upload",
+                            data=fields, files={"photo": ("photo.jpg", photo, "image/jpeg")})
+
+
+async def admin(client, recorder, event, stop, interval):
+    while not stop.is_set():
+        await recorder.call(client, "GET /api/events/{id}/memories", "GET",
+                            f"/api/events/{event['id']}/memories", params={"limit": 50})
+        await asyncio.sleep(interval)
+
+
+async def pdf_exporter(client, recorder, event, stop, interval):
+    while not stop.is_set():
+        await recorder.call(client, "GET /api/events/{id}/pdf", "GET", f"/api/events/{event['id']}/pdf")
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run(args):
+    photos = [photo_bytes(args.photo_edge, seed) for seed in range(8)]
+    limits = httpx.Limits(max_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        if args.event_code:
+            event = (await client.get(f"/api/events/code/{args.event_code}")).raise_for_status().json()
+        else:
+            event = (await client.post("/api/events", json={"name": "Load test", "couple_names": "Load & Test"})
+                     ).raise_for_status().json()
+        recorder = Recorder()
+        stop = asyncio.Event()
+        background = [asyncio.create_task(admin(client, recorder, event, stop, args.poll_interval))
+                      for _ in range(args.admins)]
+        if args.pdf_interval:
+            background.append(asyncio.create_task(pdf_exporter(client, recorder, event, stop, args.pdf_interval)))
+
+        guests = set()
+        start = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < args.duration:
+            # Thinning: draw at the peak rate, keep arrivals at the curve's rate
+            await asyncio.sleep(random.expovariate(args.peak_rate))
+            elapsed = time.perf_counter() - start
+            if random.random() * args.peak_rate < arrival_rate(args.curve, args.peak_rate, elapsed, args.duration):
+                task = asyncio.create_task(guest(client, recorder, event, photos, args.json_submit))
+                guests.add(task)
+                task.add_done_callback(guests.discard)
+        await asyncio.gather(*guests)
+        stop.set()
+        await asyncio.gather(*background)
+        elapsed = time.perf_counter() - start
+
+    return {
+        "base_url": args.base_url,
+        "curve": args.curve,
+        "peak_rate": args.peak_rate,
+        "duration": args.duration,
+        "photo_edge": args.photo_edge,
+        "elapsed_seconds": round(elapsed, 3),
+        "endpoints": recorder.report(elapsed),
+    }
+
+
+def print_report(report):
+    print(f"{'endpoint':40} {'reqs':>6} {'err%':>6} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, stats in report["endpoints"].items():
+        print(f"{name:40} {stats['requests']:>6} {stats['error_rate'] * 100:>6.2f} {stats['throughput_rps']:>7.2f} "
+              f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8001")
+    parser.add_argument("--event-code", help="use this event instead of creating one")
+    parser.add_argument("--curve", choices=CURVES, default="burst")
+    parser.add_argument("--peak-rate", type=float, default=10.0, help="guest arrivals per second at the peak")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds during which guests arrive")
+    parser.add_argument("--photo-edge", type=int, default=3000, help="longest edge of submitted photos in px")
+    parser.add_argument("--json-submit", action="store_true", help="submit base64 JSON to POST /api/memories")
+    parser.add_argument("--admins", type=int, default=2, help="clients polling the memory listing")
+    parser.add_argument("--poll-interval", type=float, default=5.0)
+    parser.add_argument("--pdf-interval", type=float, default=30.0, help="seconds between PDF exports, 0 to disable")
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", default="loadtest-results.json")
+    args = parser.parse_args()
+    if args.peak_rate <= 0 or args.duration <= 0 or not math.isfinite(args.peak_rate):
+        parser.error("--peak-rate and --duration must be positive")
+
+    report = asyncio.run(run(args))
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print_report(report)
+    print(f"\nWritten to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""In-process metrics with Prometheus text exposition.
+
+Counters and histograms are plain dicts of floats behind a lock: recording
+costs a bisect and a few additions, so everything stays enabled in
+production. Three sources feed them:
+
+* ``MetricsMiddleware`` times every HTTP request by route template and
+  records request and response body sizes.
+* ``MongoCommandListener`` times every MongoDB command by collection; pass it
+  to ``AsyncIOMotorClient(event_listeners=[...])``.
+* The PDF and image pipelines record pages rendered and decode times.
+
+Values are per process; with several workers each one exposes its own.
+"""
+import bisect
+import threading
+import time
+
+from pymongo import monitoring
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+_registry = []
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def _labels(self, labels):
+        return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{{{self._labels(labels)}}} {_number(value)}" if labels else f"{self.name} {_number(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # per-bucket counts (not cumulative), then sum and count
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(state)) for labels, state in self._values.items()]
+        for labels, state in items:
+            prefix = self._labels(labels)
+            prefix = prefix + "," if prefix else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                yield f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}'
+            suffix = f"{{{prefix[:-1]}}}" if prefix else ""
+            yield f"{self.name}_sum{suffix} {_number(state[-2])}"
+            yield f"{self.name}_count{suffix} {state[-1]}"
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def render():
+    """Return every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+http_request_duration = Histogram(
+    "memora_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+http_request_size = Histogram(
+    "memora_http_request_size_bytes", "HTTP request body size by route", ("method", "route"), SIZE_BUCKETS)
+http_response_size = Histogram(
+    "memora_http_response_size_bytes", "HTTP response body size by route", ("method", "route"), SIZE_BUCKETS)
+mongo_command_duration = Histogram(
+    "memora_mongo_command_duration_seconds", "MongoDB command latency", ("collection", "command"))
+mongo_command_failures = Counter(
+    "memora_mongo_command_failures_total", "Failed MongoDB commands", ("collection", "command"))
+pdf_pages_rendered = Counter(
+    "memora_pdf_pages_rendered_total", "Book pages rendered (page cache misses)")
+pdf_pages_cached = Counter(
+    "memora_pdf_pages_cached_total", "Book pages served from the page cache")
+pdf_batch_duration = Histogram(
+    "memora_pdf_batch_render_seconds", "Time to render one batch of book pages in the process pool")
+image_decode_duration = Histogram(
+    "memora_image_decode_seconds", "Time to decode and normalise an uploaded image")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and body sizes per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = [500]
+        sizes = [0, 0]
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes[0] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes[1] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            # The router stores the matched route in the scope; unmatched
+            # paths are grouped so arbitrary URLs cannot grow the label set
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            http_request_duration.observe(time.perf_counter() - start, method, route, str(status[0]))
+            http_request_size.observe(sizes[0], method, route)
+            http_response_size.observe(sizes[1], method, route)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times MongoDB commands; pymongo calls it from its own threads."""
+
+    def __init__(self):
+        self._started = {}
+
+    def started(self, event):
+        # For CRUD commands the command's value is the collection name
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        self._started[(event.connection_id, event.request_id)] = (time.perf_counter(), collection)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        started = self._finish(event)
+        if started:
+            mongo_command_failures.inc(started[1], event.command_name)
+
+    def _finish(self, event):
+        started = self._started.pop((event.connection_id, event.request_id), None)
+        if started:
+            mongo_command_duration.observe(time.perf_counter() - started[0], started[1], event.command_name)
+        return started
@@ -0,0 +1,112 @@
+"""Move base64 photos and backgrounds embedded in documents into the blob store.
+
+Run from the backend directory:
+
+    python migrate_photos.py [--dry-run] [--batch-size 100]
+
+Each migrated document gets a ``photo_key`` and ``photo_renditions`` and its
+``photo`` field cleared. Documents that already reference a blob but predate
+the rendition pipeline get their renditions backfilled. The script is
+idempotent: fully migrated documents are skipped.
+
+Background images embedded in the settings and event documents are replaced
+by ``/api/backgrounds/<key>`` URLs and their size variants.
+"""
+import argparse
+import asyncio
+import base64
+import os
+from pathlib import Path
+
+import certifi
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from images import store_photo, BACKGROUND_RENDITIONS
+from storage import get_blob_store
+
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+
+def decode_data_url(data: str) -> bytes:
+    if data.startswith('data:'):
+        data = data.split(',', 1)[1]
+    return base64.b64decode(data)
+
+
+async def migrate(db, blob_store, batch_size=100, dry_run=False):
+    query = {"$or": [
+        {"photo": {"$regex": "^data:"}, "photo_key": {"$in": [None, ""]}},
+        {"photo_key": {"$nin": [None, ""]}, "photo_renditions": {"$in": [None, {}]}},
+    ]}
+    migrated = failed = 0
+    cursor = db.memories.find(query, {"_id": 0, "id": 1, "photo": 1, "photo_key": 1}).batch_size(batch_size)
+    async for memory in cursor:
+        if dry_run:
+            migrated += 1
+            continue
+        try:
+            if memory.get('photo_key'):
+                photo_bytes = await blob_store.get(memory['photo_key'])
+            else:
+                photo_bytes = decode_data_url(memory['photo'])
+            key, renditions = await store_photo(blob_store, photo_bytes)
+        except (KeyError, ValueError) as e:
+            print(f"Skipping memory {memory.get('id')}: {e}")
+            failed += 1
+            continue
+        await db.memories.update_one(
+            {"id": memory['id']},
+            {"$set": {"photo_key": key, "photo_renditions": renditions, "photo": None}}
+        )
+        migrated += 1
+    return migrated, failed
+
+
+async def migrate_backgrounds(db, blob_store, dry_run=False):
+    migrated = failed = 0
+    for collection in (db.settings, db.events):
+        cursor = collection.find({"background_image": {"$regex": "^data:"}}, {"background_image": 1})
+        async for doc in cursor:
+            if dry_run:
+                migrated += 1
+                continue
+            try:
+                _, variants = await store_photo(blob_store, decode_data_url(doc['background_image']),
+                                                BACKGROUND_RENDITIONS)
+            except ValueError as e:
+                print(f"Skipping {collection.name} background {doc['_id']}: {e}")
+                failed += 1
+                continue
+            urls = {name: f"/api/backgrounds/{variant['key']}" for name, variant in variants.items()}
+            await collection.update_one(
+                {"_id": doc['_id']},
+                {"$set": {"background_image": urls['medium'], "background_variants": urls}}
+            )
+            migrated += 1
+    return migrated, failed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="report what would be migrated")
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"], tlsCAFile=certifi.where())
+    db = client[os.environ["DB_NAME"]]
+    try:
+        blob_store = get_blob_store(ROOT_DIR)
+        migrated, failed = await migrate(db, blob_store, args.batch_size, args.dry_run)
+        backgrounds, backgrounds_failed = await migrate_backgrounds(db, blob_store, args.dry_run)
+    finally:
+        client.close()
+    action = "Would migrate" if args.dry_run else "Migrated"
+    print(f"{action} {migrated} photos ({failed} failed)")
+    print(f"{action} {backgrounds} backgrounds ({backgrounds_failed} failed)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
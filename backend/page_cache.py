@@ -0,0 +1,54 @@
+"""Disk cache of rendered book pages.
+
+Kept apart from ``pdf_book`` so a worker can set the cache up without
+importing reportlab; the renderer is only loaded for the first export.
+"""
+import asyncio
+import os
+from pathlib import Path
+
+
+class PageCache:
+    """Rendered page fragments on local disk, evicted least recently used."""
+
+    def __init__(self, root, max_bytes=512 * 1024 * 1024):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return self.root / key[:2] / f"{key}.pdf"
+
+    def _get(self, key):
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return data
+
+    def _put(self, key, data):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def _prune(self):
+        entries = [(p.stat(), p) for p in self.root.glob("*/*.pdf")]
+        total = sum(st.st_size for st, _ in entries)
+        for st, path in sorted(entries, key=lambda e: e[0].st_mtime):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= st.st_size
+
+    async def get(self, key):
+        return await asyncio.to_thread(self._get, key)
+
+    async def put(self, key, data):
+        await asyncio.to_thread(self._put, key, data)
+
+    async def prune(self):
+        await asyncio.to_thread(self._prune)
@@ -0,0 +1,588 @@
+"""Book-of-memories PDF renderer.
+
+Every memory is rendered as a PDF fragment of its page. Fragments are rendered
+in chunks by a process pool, so reportlab never runs on the event loop, and
+are stitched into one document by ``PdfConcatenator`` as they complete. The
+merged book is streamed to the client as it is built; only a bounded window
+of fragments is ever held in memory.
+
+Fragments are cached by a fingerprint of the memory's content and the page
+layout, so exporting a book again only renders memories that are new or
+changed since the last export.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from reportlab import rl_config
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+import metrics
+from export_profiles import DEFAULT_PROFILE, PAGE_RENDER_VERSION, PROFILES, photo_edge
+from images import as_rgb_jpeg
+from text_layout import fit_message, lines_fitting, text_width
+
+
+# Write image and page streams as binary instead of ASCII85, which inflates
+# every embedded photo by a quarter
+rl_config.useA85 = 0
+
+# Page geometry for each book style. "event" is the per-event book,
+# "classic" the legacy book of every memory.
+LAYOUTS = {
+    "event": {
+        "image_size": 3 * inch,
+        "image_top": 5.5 * inch,
+        "name_size": 26,
+        "name_top": 6.2 * inch,
+        "question_size": 16,
+        "question_top": 6.8 * inch,
+        "box_width": 5.5 * inch,
+        "box_height": 2.8 * inch,
+        "box_top": 10 * inch,
+        "text_size": 14,
+        "text_padding": 25,
+        "text_top": 35,
+        "leading": 22,
+        "min_text_size": 10,
+    },
+    "classic": {
+        "image_size": 2.5 * inch,
+        "image_top": 5 * inch,
+        "name_size": 20,
+        "name_top": 5.5 * inch,
+        "question_size": 14,
+        "question_top": 6.2 * inch,
+        "box_width": 5 * inch,
+        "box_height": 2.5 * inch,
+        "box_top": 9 * inch,
+        "text_size": 12,
+        "text_padding": 20,
+        "text_top": 30,
+        "leading": 18,
+        "min_text_size": 9,
+    },
+}
+
+
+# Static page furniture. Add an entry to give an event's book its own look.
+PAGE_TEMPLATES = {
+    "memories": {
+        "title": ("This is your page in", "their book of memories."),
+        "border_color": (0.9, 0.89, 0.88),
+        "box_color": (0.96, 0.96, 0.95),
+    },
+}
+
+DEFAULT_TEMPLATE = "memories"
+
+
+def draw_page(c, page, layout, images, template, profile=DEFAULT_PROFILE):
+    """Draw the memory's page, followed by continuation pages for a message
+    too long for its box even at the smallest text size."""
+    width, height = A4
+    use_form(c, "page", draw_page_furniture, layout, template)
+
+    # Photo
+    if page.get('photo'):
+        try:
+            img_size = layout['image_size']
+            img = image_reader(page['photo'], images, profile, photo_edge(profile, img_size))
+            img_x = (width - img_size) / 2
+            img_y = height - layout['image_top']
+            c.drawImage(img, img_x, img_y, width=img_size, height=img_size, preserveAspectRatio=True, mask='auto')
+        except Exception as e:
+            logging.error(f"Error adding photo: {e}")
+
+    # Guest name
+    c.setFillColorRGB(0.11, 0.1, 0.09)
+    name = page.get('guest_name') or 'Guest'
+    draw_centred(c, name, "Helvetica-Bold", layout['name_size'], height - layout['name_top'])
+
+    # Question
+    question = page.get('question') or ''
+    draw_centred(c, question, "Helvetica-Oblique", layout['question_size'], height - layout['question_top'])
+
+    # Message
+    box_height = layout['box_height']
+    text = fit_message(
+        page.get('message') or '', "Helvetica", layout['text_size'], layout['leading'],
+        layout['box_width'] - 40, text_height(layout, box_height), layout['min_text_size'],
+    )
+    draw_lines(c, layout, height - layout['box_top'], box_height, text.lines, text)
+
+    overflow = text.overflow
+    box_height = height - CONTINUATION_BOX_TOP - CONTINUATION_BOX_BOTTOM
+    capacity = lines_fitting(text_height(layout, box_height, text.size), text.leading)
+    while overflow:
+        c.showPage()
+        use_form(c, "continuation", draw_continuation_furniture, layout, template)
+        c.setFillColorRGB(0.11, 0.1, 0.09)
+        draw_centred(c, f"{name}, continued", "Helvetica-Oblique", layout['question_size'], height - 1.5*inch)
+        draw_lines(c, layout, CONTINUATION_BOX_BOTTOM, box_height, overflow[:capacity], text)
+        overflow = overflow[capacity:]
+
+
+# Message box of continuation pages, measured from the bottom and top edges
+CONTINUATION_BOX_TOP = 2 * inch
+CONTINUATION_BOX_BOTTOM = 1.2 * inch
+
+
+def use_form(c, name, draw, *args):
+    """Place form XObject ``name``, drawing it with ``draw`` on first use.
+
+    The form's bytes are the same in every fragment, so ``PdfConcatenator``
+    writes it once per book and every page only references it.
+    """
+    if not c.hasForm(name):
+        c.beginForm(name)
+        draw(c, *args)
+        c.endForm()
+    c.doForm(name)
+
+
+def draw_page_furniture(c, layout, template):
+    width, height = A4
+    draw_borders(c, template)
+
+    # Title
+    c.setFillColorRGB(0.11, 0.1, 0.09)
+    for line, top in zip(template['title'], (1.5*inch, 2*inch)):
+        draw_centred(c, line, "Helvetica-Bold", 24, height - top)
+
+    draw_box(c, layout, height - layout['box_top'], layout['box_height'], template)
+
+
+def draw_continuation_furniture(c, layout, template):
+    height = A4[1]
+    draw_borders(c, template)
+    draw_box(c, layout, CONTINUATION_BOX_BOTTOM, height - CONTINUATION_BOX_TOP - CONTINUATION_BOX_BOTTOM, template)
+
+
+def draw_borders(c, template):
+    width, height = A4
+    # Decorative border
+    c.setStrokeColorRGB(*template['border_color'])
+    c.setLineWidth(2)
+    margin = 0.5 * inch
+    c.rect(margin, margin, width - 2*margin, height - 2*margin)
+
+    # Inner border
+    c.setLineWidth(0.5)
+    inner_margin = 0.7 * inch
+    c.rect(inner_margin, inner_margin, width - 2*inner_margin, height - 2*inner_margin)
+
+
+def draw_box(c, layout, box_y, box_height, template):
+    box_width = layout['box_width']
+    c.setFillColorRGB(*template['box_color'])
+    c.roundRect((A4[0] - box_width) / 2, box_y, box_width, box_height, 10, fill=1, stroke=0)
+
+
+def draw_centred(c, text, font, size, y):
+    c.setFont(font, size)
+    c.drawString((A4[0] - text_width(text, font, size)) / 2, y, text)
+
+
+def text_height(layout, box_height, text_size=None):
+    # Span of the baselines in a box: the first sits text_top below its top
+    # edge and the last as far above its bottom edge as the first line's
+    # top is below the box's
+    text_size = text_size or layout['text_size']
+    return box_height - 2 * layout['text_top'] + text_size
+
+
+def draw_lines(c, layout, box_y, box_height, lines, text):
+    box_x = (A4[0] - layout['box_width']) / 2
+    c.setFillColorRGB(0.11, 0.1, 0.09)
+    c.setFont("Helvetica", text.size)
+    y_offset = box_y + box_height - layout['text_top']
+    for line in lines:
+        c.drawString(box_x + layout['text_padding'], y_offset, line)
+        y_offset -= text.leading
+
+
+def image_reader(data, images, profile=DEFAULT_PROFILE, max_edge=None):
+    """Return a cached ``ImageReader`` for encoded image ``data``, converted
+    as export profile ``profile`` requires for a photo ``max_edge`` pixels
+    wide.
+
+    Readers are read straight from memory, so JPEG photos are embedded with
+    their original DCT stream, and reusing the reader for a repeated photo
+    lets reportlab draw the existing XObject without decoding it again.
+    """
+    digest = hashlib.sha1(data).digest()
+    if digest not in images:
+        spec = PROFILES[profile]
+        if spec['dpi']:
+            data = as_rgb_jpeg(data, max_edge if spec['resample'] else None, spec['quality'])
+        images[digest] = ImageReader(BytesIO(data))
+    return images[digest]
+
+
+def render_pages(pages, layout_name, template_name=DEFAULT_TEMPLATE, profile=DEFAULT_PROFILE):
+    """Render each of ``pages`` as a PDF of its page and any continuation
+    pages. Runs in a pool worker."""
+    layout = LAYOUTS[layout_name]
+    template = PAGE_TEMPLATES[template_name]
+    images = {}
+    fragments = []
+    for page in pages:
+        buffer = BytesIO()
+        c = canvas.Canvas(buffer, pagesize=A4)
+        draw_page(c, page, layout, images, template, profile)
+        c.showPage()
+        c.save()
+        fragments.append(buffer.getvalue())
+    return fragments
+
+
+def page_fingerprint(page, layout_name, template_name=DEFAULT_TEMPLATE, profile=DEFAULT_PROFILE):
+    """Cache key for a page: memory id, every drawn field, the layout, the
+    page template and the export profile."""
+    parts = [
+        PAGE_RENDER_VERSION,
+        layout_name,
+        LAYOUTS[layout_name],
+        template_name,
+        PAGE_TEMPLATES[template_name],
+        profile,
+        PROFILES[profile],
+        page.get('id'),
+        page.get('guest_name'),
+        page.get('question'),
+        page.get('message'),
+        page.get('photo_ref'),
+    ]
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+_OBJ_REF_RE = re.compile(rb"(\d+) 0 R")
+_TYPE_RE = re.compile(rb"/Type\s*/(\w+)")
+_KIDS_RE = re.compile(rb"/Kids\s*\[([^\]]*)\]")
+_STREAM_RE = re.compile(rb">>\s*stream\r?\n")
+
+
+class PdfConcatenator:
+    """Incrementally concatenate the pages of reportlab-generated PDFs.
+
+    ``header()``, then ``add()`` for each fragment and ``finish()`` return the
+    bytes of one merged document in order. Only object offsets, page
+    numbers and digests of shared resources are retained between calls,
+    never the fragments themselves. Images, fonts, form XObjects and
+    resource dictionaries that are identical to one already written, once
+    their references are renumbered, are not written again; later fragments
+    reference the first copy.
+    Fragments must use classic xref tables and a flat page tree, as reportlab
+    writes them.
+    """
+
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self):
+        self.offset = 0
+        self.next_num = 3
+        self.offsets = {}
+        self.kids = []
+        self.shared = {}
+
+    def _emit(self, chunks, num, body):
+        data = b"%d 0 obj\n" % num + body + b"\nendobj\n"
+        self.offsets[num] = self.offset
+        self.offset += len(data)
+        chunks.append(data)
+
+    def header(self):
+        data = b"%PDF-1.4\n%\x93\x8c\x8b\x9e\n"
+        self.offset += len(data)
+        return data
+
+    def add(self, pdf):
+        objects, root, info = _parse_objects(pdf)
+        skipped = {root, info}
+        pages_num = None
+        kids = []
+        for num, body in objects.items():
+            obj_type = _object_type(body)
+            if obj_type == b"Pages":
+                pages_num = num
+                kids = [int(n) for n in _OBJ_REF_RE.findall(_KIDS_RE.search(body).group(1))]
+            if obj_type in (b"Catalog", b"Pages", b"Outlines"):
+                skipped.add(num)
+
+        mapping = {pages_num: self.PAGES}
+        written = set()
+        # Shared resources first. One is only identified once everything it
+        # references is, so a form is matched after its fonts and images.
+        candidates = {num for num, body in objects.items() if num not in skipped and _shareable(body)}
+        shared = set()
+        while True:
+            ready = [num for num in sorted(candidates - shared) if _references(objects[num]) <= shared]
+            if not ready:
+                break
+            for num in ready:
+                digest = hashlib.sha1(_renumber(objects[num], mapping)).digest()
+                if digest in self.shared:
+                    mapping[num] = self.shared[digest]
+                else:
+                    mapping[num] = self.shared[digest] = self.next_num
+                    written.add(num)
+                    self.next_num += 1
+                shared.add(num)
+        for num in objects:
+            if num in skipped or num in shared:
+                continue
+            mapping[num] = self.next_num
+            written.add(num)
+            self.next_num += 1
+
+        chunks = []
+        for num, body in objects.items():
+            if num in written:
+                self._emit(chunks, mapping[num], _renumber(body, mapping))
+        self.kids.extend(mapping[n] for n in kids)
+        return b"".join(chunks)
+
+    def finish(self, title="Memora"):
+        chunks = []
+        kids = b" ".join(b"%d 0 R" % n for n in self.kids)
+        self._emit(chunks, self.PAGES, b"<< /Type /Pages /Count %d /Kids [ %s ] >>" % (len(self.kids), kids))
+        self._emit(chunks, self.CATALOG, b"<< /Type /Catalog /Pages %d 0 R >>" % self.PAGES)
+        info_num = self.next_num
+        self.next_num += 1
+        self._emit(chunks, info_num, b"<< /Producer (Memora) /Title (%s) >>" % _pdf_string(title))
+
+        xref_offset = self.offset
+        xref = [b"xref\n0 %d\n" % self.next_num, b"0000000000 65535 f \n"]
+        for num in range(1, self.next_num):
+            xref.append(b"%010d 00000 n \n" % self.offsets[num])
+        xref.append(b"trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\n" % (self.next_num, self.CATALOG, info_num))
+        xref.append(b"startxref\n%d\n%%%%EOF\n" % xref_offset)
+        chunks.extend(xref)
+        return b"".join(chunks)
+
+
+def _pdf_string(text):
+    escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return escaped.encode("latin-1", "replace")
+
+
+def _parse_objects(pdf):
+    """Return ``({num: body}, root_num, info_num)`` using the xref table."""
+    xref_offset = int(pdf[pdf.rindex(b"startxref") + 9:].split()[0])
+    trailer_pos = pdf.index(b"trailer", xref_offset)
+    tokens = pdf[xref_offset:trailer_pos].split()[1:]
+    offsets = {}
+    i = 0
+    while i < len(tokens):
+        start, count = int(tokens[i]), int(tokens[i + 1])
+        i += 2
+        for n in range(count):
+            offset, _, kind = tokens[i:i + 3]
+            if kind == b"n":
+                offsets[start + n] = int(offset)
+            i += 3
+
+    trailer = pdf[trailer_pos:]
+    root = int(re.search(rb"/Root (\d+) 0 R", trailer).group(1))
+    info_match = re.search(rb"/Info (\d+) 0 R", trailer)
+    info = int(info_match.group(1)) if info_match else None
+
+    objects = {}
+    ordered = sorted(offsets.items(), key=lambda item: item[1])
+    for index, (num, offset) in enumerate(ordered):
+        end = ordered[index + 1][1] if index + 1 < len(ordered) else xref_offset
+        raw = pdf[offset:end]
+        body_start = raw.index(b"obj") + 3
+        body_end = raw.rindex(b"endobj")
+        objects[num] = raw[body_start:body_end].strip(b"\r\n ")
+    return dict(sorted(objects.items())), root, info
+
+
+def _object_type(body):
+    stream = _STREAM_RE.search(body)
+    match = _TYPE_RE.search(body[:stream.start()] if stream else body)
+    return match.group(1) if match else None
+
+
+def _shareable(body):
+    """Whether the object is a resource pages may share: an image, a font, a
+    form XObject or an untyped dictionary such as a font resource map."""
+    stream = _STREAM_RE.search(body)
+    head = body[:stream.start()] if stream else body
+    if b"/Subtype /Image" in head or b"/Subtype /Form" in head or b"/Type /Font" in head:
+        return True
+    return not stream and _TYPE_RE.search(head) is None
+
+
+def _references(body):
+    stream = _STREAM_RE.search(body)
+    head = body[:stream.start()] if stream else body
+    return {int(num) for num in _OBJ_REF_RE.findall(head)}
+
+
+def _renumber(body, mapping):
+    # Only the dictionary is rewritten; stream data is copied byte for byte
+    stream = _STREAM_RE.search(body)
+    head, tail = (body[:stream.end()], body[stream.end():]) if stream else (body, b"")
+
+    def replace(match):
+        new_num = mapping.get(int(match.group(1)))
+        return b"%d 0 R" % new_num if new_num else b"null"
+
+    return _OBJ_REF_RE.sub(replace, head) + tail
+
+
+# The cores are shared with the other web workers on the host
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", 0)) or max(
+    (os.cpu_count() or 1) // int(os.environ.get("WEB_CONCURRENCY", 1)), 1
+)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        # spawn rather than fork: the parent runs an event loop and Motor threads
+        _executor = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def warm_up():
+    """Start every pool worker, so the first export does not pay for
+    spawning interpreters and importing reportlab in them."""
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    await asyncio.gather(*(loop.run_in_executor(executor, _ready) for _ in range(PDF_WORKERS)))
+
+
+def _ready():
+    return True
+
+
+async def stream_book(pages, layout_name="event", chunk_pages=None, title="Memora", progress=None,
+                      load_photo=None, cache=None, template=DEFAULT_TEMPLATE, profile=DEFAULT_PROFILE):
+    """Yield a merged PDF for the async iterable ``pages``, drawn on the
+    furniture of page template ``template`` with photos prepared as export
+    profile ``profile`` specifies.
+
+    Each page is a dict with ``id``, ``guest_name``, ``question``,
+    ``message``, ``photo`` (image bytes or None) and ``photo_ref``, a stable
+    identifier of the photo. When ``photo`` is None but ``photo_ref`` is set,
+    ``await load_photo(photo_ref)`` fetches the bytes; this only happens for
+    pages missing from ``cache``. A page with ``cacheable`` set to False is
+    rendered but never stored. A page whose message overflows its box is
+    followed by continuation pages in the book.
+
+    Pages that miss the cache are rendered in chunks of ``chunk_pages``; at
+    most two chunks per worker are pending before the oldest page is written
+    out. ``progress``, if given, is called with the number of ``pages``
+    merged so far.
+    """
+    chunk_pages = chunk_pages or int(os.environ.get("PDF_CHUNK_PAGES", 16))
+    executor = get_executor()
+    window = PDF_WORKERS * 2 * chunk_pages
+    loop = asyncio.get_running_loop()
+    merger = PdfConcatenator()
+    # (future resolving to the page's fragment, cache key to store it under)
+    pending = deque()
+    batch = []
+    merged = 0
+
+    def flush():
+        if not batch:
+            return
+        futures = [future for _, future in batch]
+        rendered = loop.run_in_executor(executor, render_pages, [page for page, _ in batch], layout_name,
+                                        template, profile)
+        started = time.perf_counter()
+
+        def distribute(done):
+            if not done.cancelled() and not done.exception():
+                metrics.pdf_batch_duration.observe(time.perf_counter() - started)
+                metrics.pdf_pages_rendered.inc(amount=len(futures))
+            for index, future in enumerate(futures):
+                if future.done():
+                    continue
+                if done.cancelled():
+                    future.cancel()
+                elif done.exception():
+                    future.set_exception(done.exception())
+                else:
+                    future.set_result(done.result()[index])
+
+        rendered.add_done_callback(distribute)
+        batch.clear()
+
+    async def merge():
+        nonlocal merged
+        future, key = pending.popleft()
+        if not future.done() and any(future is f for _, f in batch):
+            flush()
+        fragment = await future
+        if key and cache:
+            await cache.put(key, fragment)
+        data = await asyncio.to_thread(merger.add, fragment)
+        merged += 1
+        if progress:
+            progress(merged)
+        return data
+
+    yield merger.header()
+    try:
+        async for page in pages:
+            key = page_fingerprint(page, layout_name, template, profile)
+            fragment = await cache.get(key) if cache else None
+            future = loop.create_future()
+            if fragment is not None:
+                metrics.pdf_pages_cached.inc()
+                future.set_result(fragment)
+                pending.append((future, None))
+            else:
+                if page.get('photo') is None and page.get('photo_ref') and load_photo:
+                    try:
+                        page = dict(page, photo=await load_photo(page['photo_ref']))
+                    except Exception as e:
+                        logging.error(f"Error loading photo: {e}")
+                        page = dict(page, cacheable=False)
+                batch.append((_worker_page(page), future))
+                pending.append((future, key if page.get('cacheable', True) else None))
+                if len(batch) >= chunk_pages:
+                    flush()
+            while len(pending) >= window:
+                yield await merge()
+        flush()
+        while pending:
+            yield await merge()
+        yield merger.finish(title)
+        if cache:
+            await cache.prune()
+    finally:
+        for future, _ in pending:
+            future.cancel()
+
+
+def _worker_page(page):
+    # Only what draw_page needs is pickled over to the pool
+    return {name: page.get(name) for name in ("guest_name", "question", "message", "photo")}
+
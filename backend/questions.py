@@ -0,0 +1,50 @@
+"""In-memory question pools for the guests' message page.
+
+A ``QuestionPool`` is built once from an event's (or the global settings')
+tone questions, with empty entries dropped, and ``draw`` returns a question
+for a tone. With balancing, each tone deals from a shuffled deck, so every
+question is served once before any is served again and no question follows
+itself across a reshuffle; without it questions are drawn independently.
+
+Pools are only consistent within one process; with several workers each
+balances its own share of the guests.
+"""
+import random
+
+
+def compact(questions) -> tuple:
+    if isinstance(questions, str):
+        questions = [questions]
+    return tuple(q.strip() for q in questions or () if isinstance(q, str) and q.strip())
+
+
+class QuestionPool:
+    def __init__(self, tone_questions: dict, balance: bool = True):
+        self.balance = balance
+        self.questions = {}
+        for tone, questions in (tone_questions or {}).items():
+            questions = compact(questions)
+            if questions:
+                self.questions[tone] = questions
+        # Drawn from for an unknown tone or none at all
+        self.questions[None] = tuple(dict.fromkeys(q for qs in self.questions.values() for q in qs))
+        self.decks = {}
+        self.last = {}
+
+    def draw(self, tone=None):
+        """A question for ``tone``, or from every tone's questions if it has
+        none; None when there are no questions at all."""
+        if tone not in self.questions:
+            tone = None
+        questions = self.questions[tone]
+        if not questions:
+            return None
+        if not self.balance:
+            return random.choice(questions)
+        deck = self.decks.get(tone)
+        if not deck:
+            deck = self.decks[tone] = random.sample(questions, len(questions))
+            if len(deck) > 1 and deck[-1] == self.last.get(tone):
+                deck[0], deck[-1] = deck[-1], deck[0]
+        question = self.last[tone] = deck.pop()
+        return question
@@ -1,63 +1,114 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse, Response
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, ReplaceOne, DeleteOne
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
+from typing import Optional
 import uuid
 from datetime import datetime, timezone
+import asyncio
 import base64
-from io import BytesIO
-from PIL import Image
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import inch
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 import tempfile
-import urllib.request
+import hashlib
+import importlib
+import json
 import random
+import sys
 import certifi
-import uuid
+from storage import get_blob_store, sniff_content_type, carries_metadata, is_blob_key, BlobNotFound
+from images import store_photo, store_upload, pick_rendition, InvalidImage, BACKGROUND_RENDITIONS
+from images import warm_up as warm_up_images
+from uploads import parse_upload, UploadRejected
+from feed import get_memory_feed
+from ingest import IngestQueue, IngestQueueFull
+from broadcast import CacheBroadcast
+from questions import QuestionPool, compact
+import metrics
+from page_cache import PageCache
+from export_profiles import PROFILES as EXPORT_PROFILES, DEFAULT_PROFILE, photo_edge
+from export_jobs import ExportJobManager, file_response
+from indexes import ensure_indexes
+from cache import AsyncTTLCache
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# Worker processes serving the app (uvicorn and gunicorn both read this)
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 1))
+
+# MongoDB connection; the connection budget is shared between the workers
 mongo_url = os.environ["MONGO_URL"]
+MONGO_POOL_SIZE = int(os.environ.get("MONGO_POOL_SIZE", 0)) or max(
+    int(os.environ.get("MONGO_POOL_BUDGET", 100)) // WEB_CONCURRENCY, 5
+)
+
+def connect_mongo() -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(
+        mongo_url,
+        tlsCAFile=certifi.where(),
+        maxPoolSize=MONGO_POOL_SIZE,
+        event_listeners=[metrics.MongoCommandListener()]
+    )
+
+# The running app's database, bound by its lifespan (see bind_database)
+db = None
+
+# Attempts at drawing an unused event code before giving up
+EVENT_CODE_ATTEMPTS = 10
+
+# Guest-facing reads of events by code and of the public settings
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", 30))
+event_code_cache = AsyncTTLCache(maxsize=1024, ttl=CACHE_TTL_SECONDS)
+settings_cache = AsyncTTLCache(maxsize=1, ttl=CACHE_TTL_SECONDS)
+
+# Question pools by event id, "" for the global settings' questions. With
+# balancing every question of a tone is served before any repeats, so pools
+# do not expire; event and settings writes invalidate them instead.
+QUESTION_BALANCE = os.environ.get("QUESTION_BALANCE", "1").lower() in ("1", "true")
+question_pools = AsyncTTLCache(maxsize=1024, ttl=None)
+
+# Content-addressed store for photos; memory documents keep only the key
+blob_store = get_blob_store(ROOT_DIR)
+
+# Largest photo accepted by the streaming upload endpoint
+MAX_PHOTO_BYTES = int(os.environ.get("MAX_PHOTO_MB", 15)) * 1024 * 1024
 
-client = AsyncIOMotorClient(
-    mongo_url,
-    tlsCAFile=certifi.where()
+# Largest event archive accepted by the import endpoint
+MAX_IMPORT_BYTES = int(os.environ.get("MAX_IMPORT_MB", 4096)) * 1024 * 1024
+
+# Rendered book pages, reused until the memory or the layout changes
+page_cache = PageCache(
+    os.environ.get("PAGE_CACHE_DIR", ROOT_DIR / "page_cache"),
+    max_bytes=int(os.environ.get("PAGE_CACHE_MAX_MB", 512)) * 1024 * 1024
 )
 
-db = client[os.environ["DB_NAME"]]
+# Pipelines loaded in the background once the worker is serving instead of by
+# the first request using them: "images", "pdf" or both, comma separated
+WARMUP = {part.strip() for part in os.environ.get("WARMUP", "").split(",") if part.strip()}
 
+# Background book exports and their cached artifacts
+export_jobs = None
 
-# Create the main app without a prefix
-app = FastAPI()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-@api_router.get("/memories")
-async def get_memories():
-    memories = await db.memories.find().to_list(1000)
-    return memories
-
-
 # Define Models
 class Settings(BaseModel):
     model_config = ConfigDict(extra="ignore")
     couple_names: str = "Anna & Nemanja"
     welcome_text: str = "Leave a memory for"
     background_image: Optional[str] = None
+    background_variants: Optional[dict] = None
     admin_password: str = "pavle0804"
     tone_page_enabled: bool = True
     tone_questions: dict = {
@@ -95,6 +146,9 @@ class Settings(BaseModel):
         ]
     }
 
+# Every settings field at its default, validated once
+DEFAULT_SETTINGS = Settings().model_dump()
+
 class Event(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -103,11 +157,31 @@ class Event(BaseModel):
     couple_names: str
     welcome_text: str = "Leave a memory for"
     background_image: Optional[str] = None
+    background_variants: Optional[dict] = None
     tone_page_enabled: bool = True
     tone_questions: Optional[dict] = None
     is_active: bool = True
+    # Denormalised memory statistics, kept current by create/delete_memory;
+    # last_memory_at is only stored once the event has a memory
+    memory_count: int = 0
+    photo_count: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class EventView(BaseModel):
+    """An event as its guests see it: the event's own fields over the global
+    settings over the defaults, with empty tone questions dropped. Kept in
+    ``event_views`` and rebuilt whenever the event or the settings change."""
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    code: str
+    name: str
+    couple_names: str
+    welcome_text: str
+    background_image: Optional[str] = None
+    background_variants: Optional[dict] = None
+    tone_page_enabled: bool
+    tone_questions: dict[str, list[str]]
+
 class EventCreate(BaseModel):
     name: str
     couple_names: str
@@ -127,6 +201,8 @@ class Memory(BaseModel):
     event_id: Optional[str] = None
     guest_name: str
     photo: Optional[str] = None
+    photo_renditions: Optional[dict] = None
+    photo_urls: Optional[dict] = None
     message: str
     tone: Optional[str] = None
     question: Optional[str] = None
@@ -143,23 +219,404 @@ class MemoryCreate(BaseModel):
 class AdminLogin(BaseModel):
     password: str
 
+def decode_data_url(data: str) -> bytes:
+    if data.startswith('data:'):
+        data = data.split(',', 1)[1]
+    return base64.b64decode(data)
+
+def photo_url(key: str) -> str:
+    return f"/api/photos/{key}"
+
+def background_url(key: str) -> str:
+    return f"/api/backgrounds/{key}"
+
+async def store_background(data: bytes) -> dict:
+    """Store a background's size variants; return the fields to set on the
+    settings or event document. `background_image` is the medium variant."""
+    _, variants = await store_photo(blob_store, data, BACKGROUND_RENDITIONS)
+    urls = {name: background_url(variant['key']) for name, variant in variants.items()}
+    return {"background_image": urls['medium'], "background_variants": urls}
+
+async def background_update(update_data: dict) -> dict:
+    # Admin clients may still send a data URL; store it like an upload
+    background = update_data.get('background_image')
+    if background and background.startswith('data:'):
+        try:
+            update_data.update(await store_background(decode_data_url(background)))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid background image")
+    return update_data
+
+async def blob_response(key: str, request: Request, not_found: str) -> Response:
+    if not is_blob_key(key):
+        raise HTTPException(status_code=404, detail=not_found)
+    # Blobs are content-addressed, so a given URL never changes
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'"{key}"'}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    try:
+        data = await blob_store.get(key)
+    except BlobNotFound:
+        raise HTTPException(status_code=404, detail=not_found)
+    if carries_metadata(data):
+        # A camera original, kept for archives and archive-quality books but
+        # never served, as its EXIF may hold where the photo was taken
+        raise HTTPException(status_code=404, detail=not_found)
+    return Response(content=data, media_type=sniff_content_type(data) or "application/octet-stream", headers=headers)
+
+def present_memory(memory: dict) -> dict:
+    # Memories stored by reference expose URLs instead of the image bytes;
+    # `photo` is the thumbnail, which is all the listing views display. The
+    # original's key stays internal.
+    photo_key = memory.pop('photo_key', None)
+    renditions = memory.get('photo_renditions')
+    if renditions:
+        memory['photo_urls'] = {name: photo_url(r['key']) for name, r in renditions.items()}
+        memory['photo'] = memory['photo_urls'].get('thumb') or photo_url(photo_key)
+    elif photo_key:
+        # Not rendered yet (see migrate_photos.py); served only if the
+        # original carries no metadata
+        memory['photo'] = photo_url(photo_key)
+    if isinstance(memory.get('created_at'), str):
+        memory['created_at'] = datetime.fromisoformat(memory['created_at'])
+    return memory
+
+def memory_delta(kind: str, memory: dict) -> dict:
+    """The small change record pushed to event feed subscribers."""
+    thumb = (memory.get('photo_renditions') or {}).get('thumb')
+    created_at = memory.get('created_at')
+    return {
+        "type": kind,
+        "id": memory.get('id'),
+        "guest_name": memory.get('guest_name'),
+        "thumb": photo_url(thumb['key']) if thumb else None,
+        "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+    }
+
+# Pushes memory changes to admin and slideshow screens
+memory_feed = None
+
+async def backfill_event_stats(events: list):
+    """Compute memory statistics for events created before they were tracked,
+    in one aggregation for all of them, and store them on the events."""
+    missing = [event['id'] for event in events if 'memory_count' not in event]
+    if not missing:
+        return
+    pipeline = [
+        {"$match": {"event_id": {"$in": missing}}},
+        {"$group": {
+            "_id": "$event_id",
+            "memory_count": {"$sum": 1},
+            "photo_count": {"$sum": {"$cond": [{"$or": [{"$ifNull": ["$photo_key", False]}, {"$ifNull": ["$photo", False]}]}, 1, 0]}},
+            "last_memory_at": {"$max": "$created_at"},
+        }},
+    ]
+    stats = {row.pop('_id'): row for row in await db.memories.aggregate(pipeline).to_list(None)}
+    for event in events:
+        if event['id'] in missing:
+            event_stats = stats.get(event['id'], {"memory_count": 0, "photo_count": 0})
+            event.update(event_stats)
+            await db.events.update_one({"id": event['id'], "memory_count": {"$exists": False}}, {"$set": event_stats})
+
+async def record_memory_added(event_id: str, created_at: str, has_photo: bool):
+    # Events without counters yet are left alone until they are backfilled
+    await db.events.update_one(
+        {"id": event_id, "memory_count": {"$exists": True}},
+        {"$inc": {"memory_count": 1, "photo_count": int(has_photo)}, "$max": {"last_memory_at": created_at}}
+    )
+
+async def record_memories_added(memories: list):
+    """Bulk form of record_memory_added for batches flushed by the ingest queue."""
+    stats = {}
+    for memory in memories:
+        if not memory.get('event_id'):
+            continue
+        count, photos, last = stats.get(memory['event_id'], (0, 0, ""))
+        stats[memory['event_id']] = (count + 1, photos + bool(memory.get('photo_key')), max(last, memory['created_at']))
+    if stats:
+        await db.events.bulk_write([
+            UpdateOne(
+                {"id": event_id, "memory_count": {"$exists": True}},
+                {"$inc": {"memory_count": count, "photo_count": photos}, "$max": {"last_memory_at": last}}
+            )
+            for event_id, (count, photos, last) in stats.items()
+        ], ordered=False)
+    for memory in memories:
+        memory_feed.publish("created", memory)
+
+# Optional write-behind queue for guest submissions during bursts
+INGEST_QUEUE = os.environ.get("INGEST_QUEUE", "").lower() in ("1", "true")
+ingest_queue = None
+
+async def record_memory_removed(event_id: str, created_at: Optional[str], has_photo: bool):
+    event = await db.events.find_one_and_update(
+        {"id": event_id, "memory_count": {"$exists": True}},
+        {"$inc": {"memory_count": -1, "photo_count": -int(has_photo)}},
+        projection={"_id": 0, "last_memory_at": 1}
+    )
+    if event and created_at and event.get('last_memory_at') == created_at:
+        # The newest memory went away; fall back to the next newest one
+        latest = await db.memories.find_one({"event_id": event_id}, {"_id": 0, "created_at": 1}, sort=[("created_at", -1)])
+        if latest:
+            await db.events.update_one({"id": event_id}, {"$set": {"last_memory_at": latest['created_at']}})
+        else:
+            await db.events.update_one({"id": event_id}, {"$unset": {"last_memory_at": ""}})
+
+# Memory listings are paged by (created_at, id), newest first
+MEMORY_PAGE_SIZE = 50
+MEMORY_MAX_PAGE_SIZE = 200
+MEMORY_LIST_FIELDS = {"id", "event_id", "guest_name", "photo", "photo_urls", "message", "tone", "question", "created_at"}
+
+def encode_cursor(memory: dict) -> str:
+    raw = json.dumps([memory['created_at'], memory.get('id')]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, memory_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Anything but strings would land in the Mongo query as operators
+    if not isinstance(created_at, str) or not isinstance(memory_id, str):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, memory_id
+
+def parse_fields(fields: Optional[str]) -> Optional[set]:
+    if not fields:
+        return None
+    requested = {f.strip() for f in fields.split(',') if f.strip()}
+    unknown = requested - MEMORY_LIST_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return requested
+
+async def list_memories(query: dict, limit: int, cursor: Optional[str], fields: Optional[str], response: Response) -> list:
+    """One page of memories; the next page's cursor goes in X-Next-Cursor."""
+    requested = parse_fields(fields)
+    if requested is None:
+        projection = {"_id": 0}
+    else:
+        # The cursor always needs id and created_at; photo URLs are derived
+        # from the stored references
+        projection = {"_id": 0, "id": 1, "created_at": 1}
+        for field in requested:
+            if field in ("photo", "photo_urls"):
+                projection.update({"photo": 1, "photo_key": 1, "photo_renditions": 1})
+            else:
+                projection[field] = 1
+
+    if cursor:
+        created_at, memory_id = decode_cursor(cursor)
+        query = {"$and": [query, {"$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": memory_id}},
+        ]}]}
+
+    limit = max(1, min(limit, MEMORY_MAX_PAGE_SIZE))
+    # Fetch one extra document to learn whether another page exists
+    memories = await db.memories.find(query, projection).sort([("created_at", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+    if len(memories) > limit:
+        memories = memories[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(memories[-1])
+
+    memories = [present_memory(memory) for memory in memories]
+    if requested is not None:
+        memories = [{field: memory.get(field) for field in requested} for memory in memories]
+    return memories
+
+# Fields the PDF book needs from each memory
+BOOK_PROJECTION = {"_id": 0, "id": 1, "guest_name": 1, "question": 1, "message": 1, "photo": 1, "photo_key": 1, "photo_renditions": 1}
+
+async def iter_book_pages(cursor, min_edge: Optional[int], question: Optional[str] = None, default_question: str = ""):
+    # Photos stored by reference are only fetched by the renderer, and only
+    # for pages that are not already in the page cache
+    async for memory in cursor:
+        page = {
+            "id": memory.get('id'),
+            "guest_name": memory.get('guest_name', 'Guest'),
+            "question": question or memory.get('question') or default_question,
+            "message": memory.get('message', ''),
+            "photo": None,
+            "photo_ref": None,
+        }
+        if memory.get('photo_key') and min_edge is None:
+            # The original upload
+            page['photo_ref'] = memory['photo_key']
+        elif memory.get('photo_renditions'):
+            # Smallest rendition covering `min_edge` pixels, or the largest
+            page['photo_ref'] = pick_rendition(memory['photo_renditions'], min_edge)
+        elif memory.get('photo_key'):
+            page['photo_ref'] = memory['photo_key']
+        elif memory.get('photo'):
+            # Legacy document that still embeds the photo as base64
+            try:
+                page['photo'] = decode_data_url(memory['photo'])
+                page['photo_ref'] = hashlib.sha256(page['photo']).hexdigest()
+            except ValueError as e:
+                logging.error(f"Error adding photo: {e}")
+        yield page
+
+def render_book(pages, layout_name, title, progress=None, profile=DEFAULT_PROFILE):
+    # reportlab is only loaded by the first export
+    from pdf_book import stream_book
+    return stream_book(pages, layout_name, title=title, progress=progress, load_photo=blob_store.get,
+                       cache=page_cache, profile=profile)
+
+def event_book_pages(event_id: str, profile: str = DEFAULT_PROFILE):
+    cursor = db.memories.find({"event_id": event_id}, BOOK_PROJECTION).sort("created_at", -1)
+    # Photos are 3 inches wide on event pages
+    return iter_book_pages(cursor, min_edge=photo_edge(profile, 3 * 72),
+                           default_question="What do you wish them never to forget?")
+
+def render_event_book(pages, title, progress=None, profile=DEFAULT_PROFILE):
+    return render_book(pages, "event", title, progress, profile)
+
+def check_export_profile(profile: str) -> str:
+    if profile not in EXPORT_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown export profile, expected one of: {', '.join(EXPORT_PROFILES)}")
+    return profile
+
+def book_filename(couple_names: str) -> str:
+    return f"memora_{couple_names.replace(' ', '_').replace('&', 'and')}.pdf"
+
+def present_export_job(job: dict) -> dict:
+    if job['status'] == 'done':
+        job['download_url'] = f"/api/events/{job['event_id']}/pdf/jobs/{job['id']}/download"
+    return job
+
+SETTINGS_SINGLETON = "settings"
+
 # Initialize settings if not exists
 async def init_settings():
-    settings = await db.settings.find_one({}, {"_id": 0})
-    default_settings = Settings().model_dump()
-    if not settings:
-        await db.settings.insert_one(default_settings)
-        return default_settings
+    default_settings = DEFAULT_SETTINGS
+    # The settings document is marked as the singleton, which is unique, so
+    # workers starting together seed it exactly once
+    await db.settings.update_one({"singleton": {"$exists": False}}, {"$set": {"singleton": SETTINGS_SINGLETON}})
+    try:
+        await db.settings.update_one(
+            {"singleton": SETTINGS_SINGLETON}, {"$setOnInsert": default_settings}, upsert=True
+        )
+    except DuplicateKeyError:
+        pass
+    settings = await db.settings.find_one({"singleton": SETTINGS_SINGLETON}, {"_id": 0, "singleton": 0})
     # Merge with defaults to add any new fields
-    for key, value in default_settings.items():
-        if key not in settings:
-            settings[key] = value
-            await db.settings.update_one({}, {"$set": {key: value}})
+    missing = {key: value for key, value in default_settings.items() if key not in settings}
+    if missing:
+        await db.settings.update_one({"singleton": SETTINGS_SINGLETON}, {"$set": missing})
+        settings.update(missing)
     return settings
 
-@app.on_event("startup")
-async def startup_event():
-    await init_settings()
+def build_event_view(event: dict, settings: dict) -> dict:
+    layers = (event, settings, DEFAULT_SETTINGS)
+
+    def first(field):
+        return next((layer[field] for layer in layers if layer.get(field) not in (None, "")), None)
+
+    # The background and its variants come from the same layer
+    background = next((layer for layer in layers if layer.get('background_image')), {})
+    tones = {}
+    for layer in reversed(layers):
+        tones.update(dict.fromkeys(layer.get('tone_questions') or {}))
+    tone_questions = {}
+    for tone in tones:
+        # A tone left empty on the event falls back to the settings' questions
+        candidates = (compact((layer.get('tone_questions') or {}).get(tone)) for layer in layers)
+        tone_questions[tone] = list(next((questions for questions in candidates if questions), ()))
+    return EventView(
+        id=event['id'],
+        code=event['code'],
+        name=event.get('name', ''),
+        couple_names=first('couple_names'),
+        welcome_text=first('welcome_text'),
+        background_image=background.get('background_image'),
+        background_variants=background.get('background_variants'),
+        tone_page_enabled=first('tone_page_enabled'),
+        tone_questions=tone_questions,
+    ).model_dump()
+
+async def refresh_event_views(event_ids: Optional[list] = None):
+    """Rebuild the guest read model of the given events, or of every active
+    event; views of events that are no longer active are removed."""
+    settings = await load_public_settings()
+    # Guests only look up active events, so a full rebuild skips the rest
+    query = {"id": {"$in": list(event_ids)}} if event_ids is not None else {"is_active": True}
+    requests = []
+    refreshed = []
+    async for event in db.events.find(query, {"_id": 0}):
+        refreshed.append(event['id'])
+        if event.get('is_active', True) and event.get('code'):
+            requests.append(ReplaceOne({"id": event['id']}, build_event_view(event, settings), upsert=True))
+        else:
+            requests.append(DeleteOne({"id": event['id']}))
+        if len(requests) >= 500:
+            await db.event_views.bulk_write(requests, ordered=False)
+            requests = []
+    if requests:
+        await db.event_views.bulk_write(requests, ordered=False)
+    if event_ids is None:
+        await db.event_views.delete_many({"id": {"$nin": refreshed}})
+
+async def load_event_view(code: str) -> Optional[dict]:
+    view = await db.event_views.find_one({"code": code}, {"_id": 0})
+    if view is None:
+        # Not materialised yet, e.g. the event was written by an older release
+        event = await db.events.find_one({"code": code, "is_active": True}, {"_id": 0, "id": 1})
+        if event:
+            await refresh_event_views([event['id']])
+            view = await db.event_views.find_one({"code": code}, {"_id": 0})
+    return view
+
+async def find_active_event_by_code(code: str) -> Optional[dict]:
+    code = code.upper()
+    return await event_code_cache.get_or_load(code, lambda: load_event_view(code))
+
+async def event_changed(event_id: str):
+    await refresh_event_views([event_id])
+    invalidate_event(event_id)
+
+async def settings_changed():
+    # Every event view merges the settings
+    await refresh_event_views()
+    invalidate_settings()
+
+def invalidate_event(event_id: str, broadcast: bool = True):
+    event_code_cache.invalidate_where(lambda code, event: event['id'] == event_id)
+    question_pools.invalidate(event_id)
+    if broadcast:
+        cache_broadcast.publish({"cache": "event", "event_id": event_id})
+
+def invalidate_settings(broadcast: bool = True):
+    settings_cache.clear()
+    event_code_cache.clear()
+    question_pools.clear()
+    if broadcast:
+        cache_broadcast.publish({"cache": "settings"})
+
+def apply_invalidation(message: dict):
+    # Sent by another worker; apply locally without sending it on
+    if message.get('cache') == 'event':
+        invalidate_event(message['event_id'], broadcast=False)
+    elif message.get('cache') == 'settings':
+        invalidate_settings(broadcast=False)
+    elif message.get('feed') == 'memory' and hasattr(memory_feed, 'deliver'):
+        memory_feed.deliver(message['event_id'], message['delta'])
+
+def relay_feed_delta(event_id: str, delta: dict):
+    cache_broadcast.publish({"feed": "memory", "event_id": event_id, "delta": delta})
+
+# Tells the other workers on this host to drop their cached copies and
+# passes on memory feed deltas
+cache_broadcast = CacheBroadcast(
+    os.environ.get("BROADCAST_DIR", Path(tempfile.gettempdir()) / f"memora-{os.environ['DB_NAME']}"),
+    apply_invalidation
+)
+
+async def load_public_settings() -> dict:
+    settings = await db.settings.find_one({}, {"_id": 0, "admin_password": 0, "singleton": 0})
+    if not settings:
+        await init_settings()
+        settings = await db.settings.find_one({}, {"_id": 0, "admin_password": 0, "singleton": 0})
+    return settings
 
 # Routes
 @api_router.get("/")
@@ -168,19 +625,11 @@ async def root():
 
 @api_router.get("/settings")
 async def get_settings():
-    settings = await db.settings.find_one({}, {"_id": 0, "admin_password": 0})
-    if not settings:
-        await init_settings()
-        settings = await db.settings.find_one({}, {"_id": 0, "admin_password": 0})
-    return settings
+    return await settings_cache.get_or_load("settings", load_public_settings)
 
 @api_router.post("/admin/login")
 async def admin_login(login: AdminLogin):
-    settings = await db.settings.find_one({}, {"_id": 0})
-    if not settings:
-        settings = Settings().model_dump()
     admin_password = os.getenv("ADMIN_PASSWORD")
-    print("ENV PASS:", admin_password)
     if login.password == admin_password:
         return {"success": True, "message": "Login successful"}
 
@@ -188,56 +637,59 @@ async def admin_login(login: AdminLogin):
 
 @api_router.put("/admin/settings")
 async def update_settings(update: SettingsUpdate):
-    update_data = {k: v for k, v in update.model_dump().items() if v is not None}
+    update_data = await background_update({k: v for k, v in update.model_dump().items() if v is not None})
     if update_data:
         await db.settings.update_one({}, {"$set": update_data}, upsert=True)
-    settings = await db.settings.find_one({}, {"_id": 0, "admin_password": 0})
+        await settings_changed()
+    settings = await db.settings.find_one({}, {"_id": 0, "admin_password": 0, "singleton": 0})
     return settings
 
 @api_router.post("/admin/background")
 async def upload_background(file: UploadFile = File(...), event_id: Optional[str] = Form(None)):
     contents = await file.read()
-    base64_image = base64.b64encode(contents).decode('utf-8')
-    content_type = file.content_type or 'image/jpeg'
-    data_url = f"data:{content_type};base64,{base64_image}"
-    
+    try:
+        background = await store_background(contents)
+    except InvalidImage:
+        raise HTTPException(status_code=400, detail="Invalid background image")
+
     if event_id:
-        await db.events.update_one({"id": event_id}, {"$set": {"background_image": data_url}})
+        await db.events.update_one({"id": event_id}, {"$set": background})
+        await event_changed(event_id)
     else:
-        await db.settings.update_one({}, {"$set": {"background_image": data_url}}, upsert=True)
-    return {"success": True, "background_image": data_url}
+        await db.settings.update_one({}, {"$set": background}, upsert=True)
+        await settings_changed()
+    return {"success": True, **background}
 
 # Event Management Routes
 @api_router.post("/events", status_code=201)
 async def create_event(event: EventCreate):
-    # Generate unique code
-    code = ''.join(random.choices('ABCDEFGHJKLMNPQRSTUVWXYZ23456789', k=6))
-    # Ensure code is unique
-    while await db.events.find_one({"code": code, "is_active": True}):
-        code = ''.join(random.choices('ABCDEFGHJKLMNPQRSTUVWXYZ23456789', k=6))
-    
-    default_settings = Settings()
-    event_obj = Event(
-        code=code,
-        name=event.name,
-        couple_names=event.couple_names,
-        welcome_text=event.welcome_text,
-        tone_questions=default_settings.tone_questions
-    )
-    doc = event_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.events.insert_one(doc)
+    # Codes are random; the unique index on active codes rejects a clash
+    for _ in range(EVENT_CODE_ATTEMPTS):
+        event_obj = Event(
+            name=event.name,
+            couple_names=event.couple_names,
+            welcome_text=event.welcome_text,
+            tone_questions=DEFAULT_SETTINGS['tone_questions']
+        )
+        doc = event_obj.model_dump()
+        doc['created_at'] = doc['created_at'].isoformat()
+        try:
+            await db.events.insert_one(doc)
+            break
+        except DuplicateKeyError:
+            continue
+    else:
+        raise HTTPException(status_code=503, detail="Could not allocate an event code")
+    await refresh_event_views([event_obj.id])
     return {"id": event_obj.id, "code": event_obj.code, "name": event_obj.name, "couple_names": event_obj.couple_names}
 
 @api_router.get("/events")
 async def get_events():
     events = await db.events.find({"is_active": True}, {"_id": 0}).sort("created_at", -1).to_list(100)
+    await backfill_event_stats(events)
     for event in events:
         if isinstance(event.get('created_at'), str):
             event['created_at'] = datetime.fromisoformat(event['created_at'])
-        # Count memories for this event
-        memory_count = await db.memories.count_documents({"event_id": event['id']})
-        event['memory_count'] = memory_count
     return events
 
 @api_router.get("/events/{event_id}")
@@ -249,334 +701,295 @@ async def get_event(event_id: str):
 
 @api_router.get("/events/code/{code}")
 async def get_event_by_code(code: str):
-    event = await db.events.find_one({"code": code.upper(), "is_active": True}, {"_id": 0})
+    event = await find_active_event_by_code(code)
     if not event:
         raise HTTPException(status_code=404, detail="Event not found or expired")
-    return event
+    # Guests get their questions from /questions/random
+    return {key: value for key, value in event.items() if key != 'tone_questions'}
+
+@api_router.get("/questions/random")
+async def random_question(tone: Optional[str] = None, event_code: Optional[str] = None):
+    """A question for ``tone`` from the event's questions, or the global
+    settings' without ``event_code``."""
+    if event_code:
+        event = await find_active_event_by_code(event_code)
+        if not event:
+            raise HTTPException(status_code=404, detail="Event not found or expired")
+        key, load_questions = event['id'], lambda: event['tone_questions']
+    else:
+        settings = await settings_cache.get_or_load("settings", load_public_settings)
+        key, load_questions = "", lambda: settings.get('tone_questions')
+
+    async def load_pool():
+        return QuestionPool(load_questions(), balance=QUESTION_BALANCE)
+
+    pool = await question_pools.get_or_load(key, load_pool)
+    return {"tone": tone, "question": pool.draw(tone)}
 
 @api_router.put("/events/{event_id}")
 async def update_event(event_id: str, update: SettingsUpdate):
-    update_data = {k: v for k, v in update.model_dump().items() if v is not None}
+    update_data = await background_update({k: v for k, v in update.model_dump().items() if v is not None})
     if update_data:
         await db.events.update_one({"id": event_id}, {"$set": update_data})
+        await event_changed(event_id)
     event = await db.events.find_one({"id": event_id}, {"_id": 0})
     return event
 
 @api_router.delete("/events/{event_id}")
 async def deactivate_event(event_id: str):
     result = await db.events.update_one({"id": event_id}, {"$set": {"is_active": False}})
+    await event_changed(event_id)
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Event not found")
     return {"success": True}
 
 @api_router.get("/events/{event_id}/memories")
-async def get_event_memories(event_id: str):
-    memories = await db.memories.find({"event_id": event_id}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    for memory in memories:
-        if isinstance(memory.get('created_at'), str):
-            memory['created_at'] = datetime.fromisoformat(memory['created_at'])
-    return memories
+async def get_event_memories(event_id: str, response: Response, limit: int = MEMORY_PAGE_SIZE, cursor: Optional[str] = None, fields: Optional[str] = None):
+    return await list_memories({"event_id": event_id}, limit, cursor, fields, response)
 
-@api_router.get("/events/{event_id}/pdf")
-async def download_event_memories_pdf(event_id: str):
+@api_router.get("/events/{event_id}/feed")
+async def event_feed(event_id: str, request: Request, since: Optional[str] = None):
+    """Server-Sent Events stream of the event's memory changes. Reconnecting
+    clients resume from the Last-Event-ID header (or `since`)."""
+    if not await db.events.find_one({"id": event_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Event not found")
+    last_token = request.headers.get("last-event-id") or since
+
+    async def stream():
+        yield "retry: 3000\n\n"
+        async for item in memory_feed.subscribe(event_id, last_token):
+            if item is None:
+                # Keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            token, delta = item
+            yield f"id: {token}\ndata: {json.dumps(delta)}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/events/{event_id}/export")
+async def export_event(event_id: str):
+    """Stream the event, its memories and their original photos as a tar archive."""
     event = await db.events.find_one({"id": event_id}, {"_id": 0})
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
-    
-   memories = await db.memories.find({"event_id": event_id}, {"_id": 0}).sort("created_at", -1).to_list(None)
+    filename = book_filename(event.get('couple_names', 'Memories')).replace('.pdf', '.tar')
+    from archive import stream_event_archive
+    return StreamingResponse(
+        stream_event_archive(db, blob_store, event),
+        media_type="application/x-tar",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
 
-   for m in memories:
-    print("PDF MEMORY:", m)
+@api_router.post("/events/import", status_code=201)
+async def import_event(request: Request):
+    """Restore an archive produced by GET /events/{event_id}/export, sent as
+    the request body."""
+    import tarfile
+    from archive import import_event_archive, InvalidArchive
+    # tarfile needs a seekable file, so the body is spooled to disk first
+    with tempfile.NamedTemporaryFile(suffix=".tar") as spool:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > MAX_IMPORT_BYTES:
+                raise HTTPException(status_code=413, detail="Archive too large")
+            await asyncio.to_thread(spool.write, chunk)
+        spool.flush()
+        try:
+            event, imported = await import_event_archive(db, blob_store, spool.name)
+        except DuplicateKeyError:
+            raise HTTPException(status_code=409, detail="Event already exists or its code is in use")
+        except (InvalidArchive, tarfile.TarError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid archive: {e}")
+    await event_changed(event['id'])
+    return {"success": True, "event_id": event['id'], "memories": imported}
+
+@api_router.get("/events/{event_id}/pdf")
+async def download_event_memories_pdf(event_id: str, request: Request, profile: str = DEFAULT_PROFILE):
+    """The event's book. ``profile`` is ``screen`` for light previews,
+    ``print`` (the default) or ``archive`` to embed the original photos."""
+    check_export_profile(profile)
+    event = await db.events.find_one({"id": event_id}, {"_id": 0})
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
 
-   buffer = BytesIO()
-   width, height = A4
-   c = canvas.Canvas(buffer, pagesize=A4)
-    
-    for i, memory in enumerate(memories):
-        # Draw decorative border
-        c.setStrokeColorRGB(0.9, 0.89, 0.88)
-        c.setLineWidth(2)
-        margin = 0.5 * inch
-        c.rect(margin, margin, width - 2*margin, height - 2*margin)
-        
-        # Draw inner border
-        c.setLineWidth(0.5)
-        inner_margin = 0.7 * inch
-        c.rect(inner_margin, inner_margin, width - 2*inner_margin, height - 2*inner_margin)
-        
-        # Title
-        c.setFillColorRGB(0.11, 0.1, 0.09)
-        c.setFont("Helvetica-Bold", 24)
-        title = "This is your page in"
-        title_width = c.stringWidth(title, "Helvetica-Bold", 24)
-        c.drawString((width - title_width) / 2, height - 1.5*inch, title)
-        
-        c.setFont("Helvetica-Bold", 24)
-        subtitle = "their book of memories."
-        subtitle_width = c.stringWidth(subtitle, "Helvetica-Bold", 24)
-        c.drawString((width - subtitle_width) / 2, height - 2*inch, subtitle)
-        
-        # Photo - LARGER SIZE
-        if memory.get('photo'):
-            try:
-                photo_data = memory['photo']
-                if photo_data.startswith('data:'):
-                    photo_data = photo_data.split(',')[1]
-                img_bytes = base64.b64decode(photo_data)
-                img = Image.open(BytesIO(img_bytes))
-                
-                img_width = 3 * inch
-                img_height = 3 * inch
-                img_x = (width - img_width) / 2
-                img_y = height - 5.5 * inch
-                
-                with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-                    img.save(tmp.name, 'PNG')
-                    c.drawImage(tmp.name, img_x, img_y, width=img_width, height=img_height, preserveAspectRatio=True, mask='auto')
-                    os.unlink(tmp.name)
-            except Exception as e:
-                logging.error(f"Error adding photo: {e}")
-        
-        # Guest name - BIGGER
-        c.setFillColorRGB(0.11, 0.1, 0.09)
-        c.setFont("Helvetica-Bold", 26)
-        name = memory.get('guest_name', 'Guest')
-        name_width = c.stringWidth(name, "Helvetica-Bold", 26)
-        c.drawString((width - name_width) / 2, height - 6.2*inch, name)
-        
-        # Question - BIGGER
-        c.setFont("Helvetica-Oblique", 16)
-        question = memory.get("question") or "What do you wish them never to forget?"
-        question_width = c.stringWidth(question, "Helvetica-Oblique", 16)
-        c.drawString((width - question_width) / 2, height - 6.8*inch, question)
-        
-        # Message box
-        c.setFillColorRGB(0.96, 0.96, 0.95)
-        box_width = 5.5 * inch
-        box_height = 2.8 * inch
-        box_x = (width - box_width) / 2
-        box_y = height - 10 * inch
-        c.roundRect(box_x, box_y, box_width, box_height, 10, fill=1, stroke=0)
-        
-        # Message text - BIGGER
-        c.setFillColorRGB(0.11, 0.1, 0.09)
-        c.setFont("Helvetica", 14)
-        message = memory.get('message', '')
-        
-        words = message.split()
-        lines = []
-        current_line = ""
-        for word in words:
-            test_line = f"{current_line} {word}".strip()
-            if c.stringWidth(test_line, "Helvetica", 14) < box_width - 40:
-                current_line = test_line
-            else:
-                if current_line:
-                    lines.append(current_line)
-                current_line = word
-        if current_line:
-            lines.append(current_line)
-        
-        y_offset = box_y + box_height - 35
-        for line in lines[:10]:
-            c.drawString(box_x + 25, y_offset, line)
-            y_offset -= 22
-        
-        if i < len(memories) - 1:
-            c.showPage()
-    
-    c.save()
-    buffer.seek(0)
-    
     couple_names = event.get('couple_names', 'Memories')
-    filename = f"memora_{couple_names.replace(' ', '_').replace('&', 'and')}.pdf"
-    
+    filename = book_filename(couple_names)
+
+    # Serve a finished export job's book if no memory changed since
+    path, version = await export_jobs.cached_artifact(event_id, couple_names, profile)
+    if path:
+        return file_response(path, request.headers.get("range"), filename, etag=version)
+
     return StreamingResponse(
-        buffer,
+        render_event_book(event_book_pages(event_id, profile), couple_names, profile=profile),
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
-@api_router.post("/events")
-async def create_event(event: dict):
-    event_id = str(uuid.uuid4())
-    event["id"] = event_id
-    await db.events.insert_one(event)
-    return event
+@api_router.post("/events/{event_id}/pdf/jobs", status_code=202)
+async def start_event_pdf_job(event_id: str, response: Response, profile: str = DEFAULT_PROFILE):
+    check_export_profile(profile)
+    event = await db.events.find_one({"id": event_id}, {"_id": 0})
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    job = await export_jobs.start(
+        event_id,
+        lambda: event_book_pages(event_id, profile),
+        lambda pages, title, progress: render_event_book(pages, title, progress, profile),
+        event.get('couple_names', 'Memories'),
+        profile
+    )
+    if job['status'] == 'done':
+        response.status_code = 200
+    return present_export_job(job)
 
+@api_router.get("/events/{event_id}/pdf/jobs/{job_id}")
+async def get_event_pdf_job(event_id: str, job_id: str):
+    job = await export_jobs.get(job_id)
+    if not job or job['event_id'] != event_id:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return present_export_job(job)
+
+@api_router.get("/events/{event_id}/pdf/jobs/{job_id}/download")
+async def download_event_pdf_job(event_id: str, job_id: str, request: Request):
+    job = await export_jobs.get(job_id)
+    if not job or job['event_id'] != event_id:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job['status'] != 'done':
+        raise HTTPException(status_code=409, detail="Export is not finished")
+    path = export_jobs.artifact_path(event_id, job['version'], job.get('profile'))
+    if not path.exists():
+        raise HTTPException(status_code=410, detail="Export was superseded by a newer one")
+    event = await db.events.find_one({"id": event_id}, {"_id": 0, "couple_names": 1}) or {}
+    filename = book_filename(event.get('couple_names', 'Memories'))
+    return file_response(path, request.headers.get("range"), filename, etag=job['version'])
 
 @api_router.post("/memories", response_model=Memory, status_code=201)
-async def create_memory(memory: MemoryCreate):
-    event_id = None
-    if memory.event_code:
-        event = await db.events.find_one({"code": memory.event_code.upper(), "is_active": True})
-        if not event:
-            raise HTTPException(status_code=404, detail="Event not found or expired")
-        event_id = event['id']
+async def create_memory(memory: MemoryCreate, response: Response):
+    event_id = await memory_event_id(memory)
     
     memory_data = memory.model_dump()
-    print(memory_data)
 
+    if memory.photo:
+        try:
+            photo_bytes = decode_data_url(memory.photo)
+            memory_data['photo_key'], memory_data['photo_renditions'] = await store_photo(blob_store, photo_bytes)
+        except (ValueError, InvalidImage):
+            raise HTTPException(status_code=400, detail="Invalid photo data")
+    return await insert_memory(memory_data, event_id, response)
+
+@api_router.post("/memories/upload", response_model=Memory, status_code=201)
+async def upload_memory(request: Request, response: Response):
+    """Multipart form of POST /memories: the `photo` file part is streamed to
+    the blob store instead of arriving as base64 inside the JSON body."""
+    try:
+        fields, photo = await parse_upload(request, blob_store, "photo", MAX_PHOTO_BYTES)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    try:
+        fields.pop('photo', None)
+        try:
+            memory = MemoryCreate(**fields)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+        event_id = await memory_event_id(memory)
+        memory_data = memory.model_dump()
+        if photo:
+            try:
+                memory_data['photo_key'], memory_data['photo_renditions'] = await store_upload(blob_store, photo)
+            except InvalidImage:
+                raise HTTPException(status_code=400, detail="Invalid photo data")
+    finally:
+        if photo:
+            await photo.abort()
+    return await insert_memory(memory_data, event_id, response)
+
+async def memory_event_id(memory: MemoryCreate):
+    if not memory.event_code:
+        return None
+    event = await find_active_event_by_code(memory.event_code)
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found or expired")
+    return event['id']
+
+async def insert_memory(memory_data: dict, event_id, response: Response):
     memory_data.pop('event_code', None)
+    memory_data['id'] = str(uuid.uuid4())
+    memory_data['photo'] = None
     memory_data['event_id'] = event_id
-    memory_data['question'] = memory.question
-   
-   doc = memory_data
-   doc['created_at'] = datetime.now(timezone.utc).isoformat()
 
-   print("INSERT DOC:", doc)
+    doc = memory_data
+    doc['created_at'] = datetime.now(timezone.utc).isoformat()
+
+    if ingest_queue:
+        try:
+            # A copy, as present_memory below changes the document
+            await ingest_queue.submit(dict(doc))
+        except IngestQueueFull:
+            raise HTTPException(status_code=503, detail="Too many submissions, please retry", headers={"Retry-After": "2"})
+        # Accepted and journaled; it is inserted with the next batch
+        response.status_code = 202
+        return Memory(**present_memory(doc))
 
-  await db.memories.insert_one(doc)
+    await db.memories.insert_one(doc)
+    if event_id:
+        await record_memory_added(event_id, doc['created_at'], bool(doc.get('photo_key')))
+        memory_feed.publish("created", doc)
 
-  return Memory(**doc)
+    return Memory(**present_memory(doc))
 
-@api_router.get("/memories", response_model=List[Memory])
-async def get_memories(event_id: str | None = None):
+@api_router.get("/memories")
+async def get_memories(response: Response, event_id: str | None = None, limit: int = MEMORY_PAGE_SIZE, cursor: Optional[str] = None, fields: Optional[str] = None):
     query = {}
     if event_id:
         query["event_id"] = event_id
-    memories = await db.memories.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    for memory in memories:
-        if isinstance(memory.get("created_at"), str):
-            memory["created_at"] = datetime.fromisoformat(memory["created_at"])
-    return memories
+    return await list_memories(query, limit, cursor, fields, response)
 
 
 @api_router.delete("/memories/{memory_id}")
 async def delete_memory(memory_id: str):
-    result = await db.memories.delete_one({"id": memory_id})
-    if result.deleted_count == 0:
+    memory = await db.memories.find_one_and_delete(
+        {"id": memory_id},
+        projection={"_id": 0, "id": 1, "event_id": 1, "guest_name": 1, "created_at": 1, "photo_key": 1, "photo": 1}
+    )
+    if not memory:
         raise HTTPException(status_code=404, detail="Memory not found")
+    if memory.get('event_id'):
+        await record_memory_removed(memory['event_id'], memory.get('created_at'), bool(memory.get('photo_key') or memory.get('photo')))
+        memory_feed.publish("deleted", memory)
     return {"success": True}
 
+@api_router.get("/photos/{key}")
+async def get_photo(key: str, request: Request):
+    return await blob_response(key, request, "Photo not found")
+
+@api_router.get("/backgrounds/{key}")
+async def get_background(key: str, request: Request):
+    return await blob_response(key, request, "Background not found")
+
 @api_router.get("/memories/pdf")
 async def download_memories_pdf():
-    memories = await db.memories.find({}, {"_id": 0}).sort("created_at", 1).to_list(1000)
-    settings = await db.settings.find_one({}, {"_id": 0})
-    
-    buffer = BytesIO()
-    width, height = A4
-    c = canvas.Canvas(buffer, pagesize=A4)
-    
-    for i, memory in enumerate(memories):
-        # Draw decorative border
-        c.setStrokeColorRGB(0.9, 0.89, 0.88)
-        c.setLineWidth(2)
-        margin = 0.5 * inch
-        c.rect(margin, margin, width - 2*margin, height - 2*margin)
-        
-        # Draw inner border
-        c.setLineWidth(0.5)
-        inner_margin = 0.7 * inch
-        c.rect(inner_margin, inner_margin, width - 2*inner_margin, height - 2*inner_margin)
-        
-        # Title
-        c.setFillColorRGB(0.11, 0.1, 0.09)
-        c.setFont("Helvetica-Bold", 24)
-        title = "This is your page in"
-        title_width = c.stringWidth(title, "Helvetica-Bold", 24)
-        c.drawString((width - title_width) / 2, height - 1.5*inch, title)
-        
-        c.setFont("Helvetica-Bold", 24)
-        subtitle = "their book of memories."
-        subtitle_width = c.stringWidth(subtitle, "Helvetica-Bold", 24)
-        c.drawString((width - subtitle_width) / 2, height - 2*inch, subtitle)
-        
-        # Photo
-        if memory.get('photo'):
-            try:
-                photo_data = memory['photo']
-                if photo_data.startswith('data:'):
-                    photo_data = photo_data.split(',')[1]
-                img_bytes = base64.b64decode(photo_data)
-                img = Image.open(BytesIO(img_bytes))
-                
-                # Resize for PDF
-                img_width = 2.5 * inch
-                img_height = 2.5 * inch
-                img_x = (width - img_width) / 2
-                img_y = height - 5 * inch
-                
-                # Save temp image
-                with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-                    img.save(tmp.name, 'PNG')
-                    c.drawImage(tmp.name, img_x, img_y, width=img_width, height=img_height, preserveAspectRatio=True, mask='auto')
-                    os.unlink(tmp.name)
-            except Exception as e:
-                logging.error(f"Error adding photo: {e}")
-        
-        # Guest name
-        c.setFillColorRGB(0.11, 0.1, 0.09)
-        c.setFont("Helvetica-Bold", 20)
-        name = memory.get('guest_name', 'Guest')
-        name_width = c.stringWidth(name, "Helvetica-Bold", 20)
-        c.drawString((width - name_width) / 2, height - 5.5*inch, name)
-        
-        # Question
-        c.setFont("Helvetica-Oblique", 14)
-        question = settings.get("question", "") or "Question"
-        question_width = c.stringWidth(question, "Helvetica-Oblique", 14)
-        c.drawString((width - question_width) / 2, height - 6.2*inch, question)
-        
-        # Message box
-        c.setFillColorRGB(0.96, 0.96, 0.95)
-        box_width = 5 * inch
-        box_height = 2.5 * inch
-        box_x = (width - box_width) / 2
-        box_y = height - 9 * inch
-        c.roundRect(box_x, box_y, box_width, box_height, 10, fill=1, stroke=0)
-        
-        # Message text
-        c.setFillColorRGB(0.11, 0.1, 0.09)
-        c.setFont("Helvetica", 12)
-        message = memory.get('message', '')
-        
-        # Word wrap
-        words = message.split()
-        lines = []
-        current_line = ""
-        for word in words:
-            test_line = f"{current_line} {word}".strip()
-            if c.stringWidth(test_line, "Helvetica", 12) < box_width - 40:
-                current_line = test_line
-            else:
-                if current_line:
-                    lines.append(current_line)
-                current_line = word
-        if current_line:
-            lines.append(current_line)
-        
-        y_offset = box_y + box_height - 30
-        for line in lines[:10]:
-            c.drawString(box_x + 20, y_offset, line)
-            y_offset -= 18
-        
-        if i < len(memories) - 1:
-            c.showPage()
-    
-    c.save()
-    buffer.seek(0)
-    
-    settings = await db.settings.find_one({}, {"_id": 0})
-    couple_names = settings.get('couple_names', 'Memories') if settings else 'Memories'
-    filename = f"memora_{couple_names.replace(' ', '_').replace('&', 'and')}.pdf"
-    
+    settings = await db.settings.find_one({}, {"_id": 0}) or {}
+    cursor = db.memories.find({}, BOOK_PROJECTION).sort("created_at", 1)
+    pages = iter_book_pages(cursor, min_edge=photo_edge(DEFAULT_PROFILE, 2.5 * 72), question=settings.get("question") or "Question")
+
+    couple_names = settings.get('couple_names', 'Memories')
+    filename = book_filename(couple_names)
+
     return StreamingResponse(
-        buffer,
+        render_book(pages, "classic", couple_names),
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
-# Include the router in the main app
-app.include_router(api_router)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=[os.getenv("CORS_ORIGINS", "http://localhost:3002")],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+async def get_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 # Configure logging
 logging.basicConfig(
@@ -585,6 +998,95 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+async def warm_up(parts):
+    try:
+        if "images" in parts:
+            await asyncio.to_thread(warm_up_images)
+        if "pdf" in parts:
+            pdf_book = await asyncio.to_thread(importlib.import_module, "pdf_book")
+            await pdf_book.warm_up()
+        logger.info("Warmed up %s", ", ".join(sorted(parts)))
+    except Exception:
+        logger.exception("Warm-up failed")
+
+def shutdown_pdf_workers():
+    # Only a worker that has loaded the renderer has a pool to stop
+    pdf_book = sys.modules.get("pdf_book")
+    if pdf_book:
+        pdf_book.shutdown_executor()
+
+def bind_database(database):
+    """Point the routes and the database's users (feed, ingest queue, export
+    jobs) at ``database``, dropping whatever was cached from another one.
+    Tools driving the app without its lifespan call this themselves."""
+    global db, memory_feed, ingest_queue, export_jobs
+    db = database
+    memory_feed = get_memory_feed(database, memory_delta, relay=relay_feed_delta)
+    ingest_queue = IngestQueue(
+        database.memories,
+        os.environ.get("INGEST_DIR", ROOT_DIR / "ingest"),
+        after_insert=record_memories_added,
+        batch_size=int(os.environ.get("INGEST_BATCH_SIZE", 200)),
+        max_delay=int(os.environ.get("INGEST_MAX_DELAY_MS", 200)) / 1000,
+        maxsize=int(os.environ.get("INGEST_QUEUE_SIZE", 5000)),
+    ) if INGEST_QUEUE else None
+    export_jobs = ExportJobManager(
+        database,
+        os.environ.get("EXPORT_DIR", ROOT_DIR / "exports"),
+        concurrency=int(os.environ.get("EXPORT_JOB_CONCURRENCY", 2))
+    )
+    invalidate_settings(broadcast=False)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Opened per app, so an app built after another one stopped (a second
+    # create_app(), or --factory next to the module's app) never inherits
+    # the closed client
+    app.state.mongo = connect_mongo()
+    app.state.db = app.state.mongo[os.environ["DB_NAME"]]
+    bind_database(app.state.db)
+    await ensure_indexes(db)
+    await init_settings()
+    await refresh_event_views()
+    await memory_feed.setup()
+    cache_broadcast.start()
+    if WEB_CONCURRENCY > 1 and cache_broadcast.sock is None:
+        logger.warning("No broadcast between the %d workers: caches expire only by TTL and "
+                       "memory feeds only show each worker's own changes", WEB_CONCURRENCY)
+    if ingest_queue:
+        await ingest_queue.start()
+    warm_up_task = asyncio.create_task(warm_up(WARMUP)) if WARMUP else None
+    yield
+    if warm_up_task:
+        warm_up_task.cancel()
+    if ingest_queue:
+        await ingest_queue.close()
+    cache_broadcast.stop()
+    await export_jobs.shutdown()
+    app.state.mongo.close()
+    shutdown_pdf_workers()
+
+def create_app() -> FastAPI:
+    """Build the application. Each worker process builds its own, e.g.
+
+        WEB_CONCURRENCY=4 uvicorn server:create_app --factory --workers 4
+
+    The MongoDB client is opened when the app starts and closed when it
+    stops. Routes share the module's caches and bound database, so one app
+    serves per process at a time.
+    """
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(api_router)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=[os.getenv("CORS_ORIGINS", "http://localhost:3002")],
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor"],
+    )
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.add_api_route("/metrics", get_metrics, include_in_schema=False)
+    return app
+
+app = create_app()
@@ -0,0 +1,269 @@
+"""Content-addressed blob storage for guest photos and other uploaded images.
+
+Blobs are keyed by the SHA-256 of their bytes, so uploading the same photo
+twice stores it once. Two backends are provided: a local filesystem store and
+an S3-compatible store (AWS, MinIO, or any local stand-in reachable through
+``S3_ENDPOINT_URL``).
+"""
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+
+BLOB_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Magic-byte prefixes of the image types guests and admins upload
+_MAGIC_TYPES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def sniff_content_type(data: bytes) -> Optional[str]:
+    for magic, content_type in _MAGIC_TYPES:
+        if data.startswith(magic):
+            return content_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def carries_metadata(data: bytes) -> bool:
+    """Whether an image holds EXIF or XMP metadata (which may include the GPS
+    position it was taken at). Renditions are encoded without any, only
+    camera originals carry it."""
+    if data.startswith(b"\xff\xd8"):
+        i = 2
+        while i + 4 <= len(data) and data[i] == 0xFF:
+            marker = data[i + 1]
+            if marker in (0xD9, 0xDA):
+                # End of image or start of the scan; no headers follow
+                break
+            if marker == 0xE1:
+                return True
+            i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+        return False
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        i = 8
+        while i + 8 <= len(data):
+            length, chunk = int.from_bytes(data[i:i + 4], "big"), data[i + 4:i + 8]
+            # iTXt is where PNG keeps XMP
+            if chunk in (b"eXIf", b"iTXt"):
+                return True
+            i += 12 + length
+        return False
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        i = 12
+        while i + 8 <= len(data):
+            chunk, length = data[i:i + 4], int.from_bytes(data[i + 4:i + 8], "little")
+            if chunk in (b"EXIF", b"XMP "):
+                return True
+            i += 8 + length + (length & 1)
+        return False
+    return False
+
+
+def blob_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_blob_key(key: str) -> bool:
+    return bool(BLOB_KEY_RE.match(key or ""))
+
+
+class BlobNotFound(KeyError):
+    pass
+
+
+class BlobWriter:
+    """Hashes and spools a single blob to a temporary file as it arrives, so
+    large uploads are never held in memory. ``commit`` moves the file into
+    the store under its content hash; ``abort`` discards it."""
+
+    HEAD_BYTES = 16
+
+    def __init__(self, store, spool_dir=None):
+        self.store = store
+        fd, self.path = tempfile.mkstemp(dir=spool_dir, prefix=".upload-")
+        self._file = os.fdopen(fd, "wb")
+        self._hash = hashlib.sha256()
+        self.size = 0
+        # First bytes, for magic-byte sniffing
+        self.head = b""
+
+    async def write(self, data: bytes) -> None:
+        self._hash.update(data)
+        self.size += len(data)
+        if len(self.head) < self.HEAD_BYTES:
+            self.head += data[:self.HEAD_BYTES - len(self.head)]
+        await asyncio.to_thread(self._file.write, data)
+
+    async def commit(self) -> str:
+        self._file.close()
+        key = self._hash.hexdigest()
+        try:
+            if not await self.store.exists(key):
+                await asyncio.to_thread(self.store._write_file, key, self.path)
+        finally:
+            self._discard()
+        return key
+
+    async def abort(self) -> None:
+        self._file.close()
+        self._discard()
+
+    def _discard(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class BlobStore(ABC):
+    """Async facade over a synchronous backend; I/O runs in worker threads."""
+
+    spool_dir = None
+
+    def writer(self) -> BlobWriter:
+        return BlobWriter(self, self.spool_dir)
+
+    async def put(self, data: bytes) -> str:
+        key = blob_key(data)
+        if not await self.exists(key):
+            await asyncio.to_thread(self._write, key, data)
+        return key
+
+    async def get(self, key: str) -> bytes:
+        return await asyncio.to_thread(self._read, key)
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self._exists, key)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+    @abstractmethod
+    def _write(self, key: str, data: bytes) -> None:
+        ...
+
+    def _write_file(self, key: str, path: str) -> None:
+        self._write(key, Path(path).read_bytes())
+
+    @abstractmethod
+    def _read(self, key: str) -> bytes:
+        ...
+
+    @abstractmethod
+    def _exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def _delete(self, key: str) -> None:
+        ...
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        # Same filesystem as the blobs, so committing an upload is a rename
+        self.spool_dir = self.root / ".incoming"
+        self.spool_dir.mkdir(exist_ok=True)
+
+    def path_for(self, key: str) -> Path:
+        if not is_blob_key(key):
+            raise BlobNotFound(key)
+        return self.root / key[:2] / key[2:4] / key
+
+    def _write(self, key, data):
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file in the same directory and rename, so readers
+        # never see a partially written blob
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(data)
+            os.replace(tmp_name, path)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+            raise
+
+    def _write_file(self, key, path):
+        target = self.path_for(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, target)
+
+    def _read(self, key):
+        try:
+            return self.path_for(key).read_bytes()
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    def _exists(self, key):
+        return self.path_for(key).exists()
+
+    def _delete(self, key):
+        try:
+            self.path_for(key).unlink()
+        except FileNotFoundError:
+            pass
+
+
+class S3BlobStore(BlobStore):
+    def __init__(self, bucket, prefix="blobs/", endpoint_url=None, client=None):
+        if client is None:
+            import boto3
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def object_key(self, key: str) -> str:
+        if not is_blob_key(key):
+            raise BlobNotFound(key)
+        return f"{self.prefix}{key}"
+
+    def _write(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.object_key(key), Body=data)
+
+    def _write_file(self, key, path):
+        # Multipart upload for large files, without reading them into memory
+        self.client.upload_file(path, self.bucket, self.object_key(key))
+
+    def _read(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))
+        except self.client.exceptions.NoSuchKey:
+            raise BlobNotFound(key)
+        return response["Body"].read()
+
+    def _exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def _delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+
+def get_blob_store(root_dir: Path) -> BlobStore:
+    backend = os.environ.get("BLOB_BACKEND", "local").lower()
+    if backend == "s3":
+        return S3BlobStore(
+            bucket=os.environ["S3_BUCKET"],
+            prefix=os.environ.get("S3_PREFIX", "blobs/"),
+            endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+        )
+    return LocalBlobStore(os.environ.get("BLOB_DIR", root_dir / "blobs"))
@@ -0,0 +1,106 @@
+"""Line breaking for the message text of book pages.
+
+Widths are summed from per-glyph metrics cached per font, so wrapping a
+message costs one lookup per character instead of measuring the whole
+growing line for every word. ``fit_message`` returns a ``MessageLayout``
+that is cached by message and box, so a page is only laid out once per
+worker however often it is exported.
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+
+_glyph_widths = {}
+
+
+def text_width(text: str, font: str, size: float) -> float:
+    """Width of ``text`` in points, as ``canvas.stringWidth`` measures it."""
+    widths = _glyph_widths.setdefault(font, {})
+    total = 0
+    for char in text:
+        width = widths.get(char)
+        if width is None:
+            width = widths[char] = stringWidth(char, font, 1000)
+        total += width
+    return total * size / 1000
+
+
+def wrap(text: str, font: str, size: float, max_width: float) -> list:
+    """Break ``text`` into lines narrower than ``max_width``.
+
+    Words are measured once and placed greedily. A word too wide for a line
+    of its own is split between characters rather than drawn past the edge.
+    """
+    space = text_width(" ", font, size)
+    lines = []
+    line, line_width = [], 0
+    for word in text.split():
+        word_width = text_width(word, font, size)
+        if word_width >= max_width:
+            pieces = _split_word(word, font, size, max_width)
+            if line:
+                lines.append(" ".join(line))
+                line = []
+            lines.extend(pieces[:-1])
+            word = pieces[-1]
+            word_width = text_width(word, font, size)
+        if line and line_width + space + word_width < max_width:
+            line.append(word)
+            line_width += space + word_width
+        else:
+            if line:
+                lines.append(" ".join(line))
+            line, line_width = [word], word_width
+    if line:
+        lines.append(" ".join(line))
+    return lines
+
+
+def _split_word(word, font, size, max_width):
+    pieces = []
+    start, width = 0, 0
+    for index, char in enumerate(word):
+        char_width = text_width(char, font, size)
+        if index > start and width + char_width >= max_width:
+            pieces.append(word[start:index])
+            start, width = index, 0
+        width += char_width
+    pieces.append(word[start:])
+    return pieces
+
+
+def lines_fitting(height: float, leading: float) -> int:
+    """Number of baselines ``leading`` apart that fit in ``height``,
+    counting the first one at the top."""
+    return int(height // leading) + 1
+
+
+@dataclass(frozen=True)
+class MessageLayout:
+    size: float
+    leading: float
+    # Lines drawn in the message box, then those continued on later pages
+    lines: tuple
+    overflow: tuple
+
+
+@lru_cache(maxsize=1024)
+def fit_message(message: str, font: str, size: float, leading: float, max_width: float,
+                height: float, min_size: float) -> MessageLayout:
+    """Lay ``message`` out in a box ``max_width`` wide whose baselines span
+    ``height``.
+
+    While the text does not fit, the font shrinks a point at a time, with
+    the leading in proportion, down to ``min_size``. Lines that still do not
+    fit are returned in ``overflow``.
+    """
+    while True:
+        lines = wrap(message, font, size, max_width)
+        capacity = lines_fitting(height, leading)
+        if len(lines) <= capacity or size - 1 < min_size:
+            break
+        leading = leading * (size - 1) / size
+        size -= 1
+    return MessageLayout(size, leading, tuple(lines[:capacity]), tuple(lines[capacity:]))
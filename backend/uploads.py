@@ -0,0 +1,123 @@
+"""Streaming multipart parsing for guest photo uploads.
+
+The request body is fed to the multipart parser chunk by chunk. The file part
+is hashed and spooled to disk by a ``BlobWriter`` as it arrives, so an upload
+holds at most one network chunk of the photo in memory. Uploads over the byte
+limit, or whose first bytes are not a supported image type, are rejected
+without reading the rest of the body.
+"""
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from storage import sniff_content_type
+
+
+class UploadRejected(ValueError):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+
+
+async def parse_upload(request, blob_store, file_field, max_bytes, max_field_bytes=64 * 1024):
+    """Return ``(fields, writer)`` for a multipart/form-data request.
+
+    ``fields`` holds the decoded text parts; ``writer`` is the ``BlobWriter``
+    holding the ``file_field`` part, or None if none was sent. The caller must
+    commit or abort the writer.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected(400, "Expected multipart/form-data")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + max_field_bytes:
+        raise UploadRejected(413, "Upload too large")
+
+    fields = {}
+    field_bytes = 0
+    files_seen = 0
+    part = {}
+    # File data received during the current parser.write(), flushed to the
+    # writer once it returns because the callbacks cannot await
+    pending = []
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, header_field=b"", header_value=b"", value=[])
+
+    def on_header_field(data, start, end):
+        part["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["header_value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["header_field"].lower()] = part["header_value"]
+        part["header_field"] = part["header_value"] = b""
+
+    def on_headers_finished():
+        nonlocal files_seen
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = disposition.get(b"name", b"").decode("utf-8", "replace")
+        part["is_file"] = b"filename" in disposition
+        if part["is_file"]:
+            files_seen += 1
+            if part["name"] != file_field or files_seen > 1:
+                raise UploadRejected(400, f"Unexpected file field '{part['name']}'")
+
+    def on_part_data(data, start, end):
+        nonlocal field_bytes
+        if part["is_file"]:
+            pending.append(bytes(data[start:end]))
+            return
+        field_bytes += end - start
+        if field_bytes > max_field_bytes:
+            raise UploadRejected(413, "Form fields too large")
+        part["value"].append(bytes(data[start:end]))
+
+    def on_part_end():
+        if not part["is_file"]:
+            fields[part["name"]] = b"".join(part["value"]).decode("utf-8", "replace")
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    writer = None
+    try:
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if not pending:
+                    continue
+                if writer is None:
+                    writer = blob_store.writer()
+                for data in pending:
+                    await writer.write(data)
+                pending.clear()
+                if writer.size > max_bytes:
+                    raise UploadRejected(413, "Photo too large")
+                if len(writer.head) >= writer.HEAD_BYTES:
+                    _check_type(writer)
+            parser.finalize()
+        except UploadRejected:
+            raise
+        except ValueError as e:
+            # Malformed multipart body
+            raise UploadRejected(400, str(e))
+        if writer is not None:
+            _check_type(writer)
+    except BaseException:
+        if writer is not None:
+            await writer.abort()
+        raise
+    return fields, writer
+
+
+def _check_type(writer):
+    if not sniff_content_type(writer.head):
+        raise UploadRejected(415, "Unsupported image type")
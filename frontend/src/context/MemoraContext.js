@@ -5,6 +5,9 @@ const MemoraContext = createContext();
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+
+// Photo and background URLs from the API are root-relative to the backend
+const assetUrl = (url) => (url && url.startsWith('/') ? `${BACKEND_URL}${url}` : url);
 ;
 const defaultToneQuestions = {
   wise: ["What wisdom would you share with them?", "", "", "", "", "", "", "", "", ""],
@@ -58,15 +61,9 @@ export const MemoraProvider = ({ children }) => {
     try {
       const response = await axios.get(`${API}/events/code/${code}`);
       setCurrentEvent(response.data);
-      // Use event settings
-      setSettings(prev => ({
-        ...prev,
-        couple_names: response.data.couple_names,
-        welcome_text: response.data.welcome_text || prev.welcome_text,
-        background_image: response.data.background_image,
-        tone_page_enabled: response.data.tone_page_enabled !== false,
-        tone_questions: response.data.tone_questions || defaultToneQuestions
-      }));
+      // Already merged with the global settings by the server
+      const { id, code: eventCode, name, ...eventSettings } = response.data;
+      setSettings(prev => ({ ...prev, ...eventSettings }));
     } catch (error) {
       console.error('Error fetching event:', error);
       // Event not found or expired
@@ -109,14 +106,18 @@ export const MemoraProvider = ({ children }) => {
 
   const submitMemory = async () => {
     try {
-      const response = await axios.post(`${API}/memories`, {
-        event_code: eventCode || null,
-        guest_name: guestName,
-        photo: photo,
-        message: message,
-        tone: selectedTone,
-        question: selectedQuestion
-      });
+      // Multipart, so the photo is sent as a file rather than base64 JSON
+      const form = new FormData();
+      if (eventCode) form.append('event_code', eventCode);
+      form.append('guest_name', guestName);
+      form.append('message', message);
+      if (selectedTone) form.append('tone', selectedTone);
+      if (selectedQuestion) form.append('question', selectedQuestion);
+      if (photo) {
+        const blob = await (await fetch(photo)).blob();
+        form.append('photo', blob, 'photo.jpg');
+      }
+      const response = await axios.post(`${API}/memories/upload`, form);
       return response.data;
     } catch (error) {
       console.error('Error submitting memory:', error);
@@ -157,7 +158,8 @@ export const MemoraProvider = ({ children }) => {
     submitMemory,
     resetMemory,
     loading,
-    API
+    API,
+    assetUrl
   };
 
   return (
@@ -26,7 +26,7 @@ const defaultQuestions = {
 
 const AdminPage = () => {
   const navigate = useNavigate();
-  const { isAdmin, adminLogin, settings, updateSettings, API, fetchSettings } = useMemora();
+  const { isAdmin, adminLogin, settings, updateSettings, API, assetUrl, fetchSettings } = useMemora();
   const [password, setPassword] = useState('');
   const [loginError, setLoginError] = useState('');
   const [events, setEvents] = useState([]);
@@ -96,8 +96,17 @@ const AdminPage = () => {
 
   const fetchEventMemories = async (eventId) => {
     try {
-      const response = await axios.get(`${API}/events/${eventId}/memories`);
-      setMemories(response.data);
+      // Memories are paged; follow the cursor until the last page
+      const all = [];
+      let cursor = null;
+      do {
+        const response = await axios.get(`${API}/events/${eventId}/memories`, {
+          params: { limit: 200, ...(cursor && { cursor }) }
+        });
+        all.push(...response.data);
+        cursor = response.headers['x-next-cursor'];
+      } while (cursor);
+      setMemories(all);
     } catch (error) {
       console.error('Error fetching memories:', error);
     }
@@ -203,7 +212,10 @@ const AdminPage = () => {
     if (!selectedEvent) return;
     setIsDownloading(true);
     try {
+      // Phones get a lighter book with screen-resolution photos
+      const profile = window.matchMedia('(max-width: 768px)').matches ? 'screen' : 'print';
       const response = await axios.get(`${API}/events/${selectedEvent.id}/pdf`, {
+        params: { profile },
         responseType: 'blob'
       });
       
@@ -401,7 +413,7 @@ const AdminPage = () => {
             <div className="memory-frame memory-frame-bottom p-4">
               {previewMemory.photo && (
                 <img 
-                  src={previewMemory.photo} 
+                  src={assetUrl(previewMemory.photo)} 
                   alt={previewMemory.guest_name}
                   className="w-32 h-32 object-cover mx-auto mb-4"
                 />
@@ -686,7 +698,7 @@ const AdminPage = () => {
                   {selectedEvent.background_image && (
                     <div className="w-32 h-32 rounded-lg overflow-hidden border border-stone-200">
                       <img 
-                        src={selectedEvent.background_image} 
+                        src={assetUrl(selectedEvent.background_image)} 
                         alt="Current background"
                         className="w-full h-full object-cover"
                         data-testid="current-background"
@@ -761,7 +773,7 @@ const AdminPage = () => {
                       >
                         {memory.photo ? (
                           <img 
-                            src={memory.photo} 
+                            src={assetUrl(memory.photo)} 
                             alt={memory.guest_name}
                             className="w-12 h-12 rounded-full object-cover"
                           />
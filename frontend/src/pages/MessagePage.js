@@ -1,13 +1,14 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { motion } from 'framer-motion';
+import axios from 'axios';
 import { useMemora } from '../context/MemoraContext';
 
 const MAX_CHARS = 200;
 
 const MessagePage = () => {
 const navigate = useNavigate();
-const { message, setMessage, guestName, selectedTone, settings, setSelectedQuestion } = useMemora();   const [inputValue, setInputValue] = useState(message);
+const { message, setMessage, guestName, selectedTone, settings, setSelectedQuestion, eventCode, API, assetUrl } = useMemora();   const [inputValue, setInputValue] = useState(message);
 
   // Redirect if no name entered
   useEffect(() => {
@@ -31,39 +32,17 @@ const { message, setMessage, guestName, selectedTone, settings, setSelectedQuest
    }
   };
 
-  // Get random question based on selected tone
+  // Random question for the selected tone, picked by the server
   const [question, setQuestion] = useState("");
   useEffect(() => {
-  if (!settings?.tone_questions) return;
+    const params = { tone: selectedTone || undefined, event_code: eventCode || undefined };
+    axios.get(`${API}/questions/random`, { params })
+      .then(response => setQuestion(response.data.question || ""))
+      .catch(error => console.error('Error fetching question:', error));
+  }, [selectedTone, eventCode, API]);
 
-  let allQuestions = [];
 
-  if (selectedTone && settings.tone_questions[selectedTone]) {
-    const toneQuestions = settings.tone_questions[selectedTone];
-    allQuestions = Array.isArray(toneQuestions)
-      ? toneQuestions
-      : [toneQuestions];
-  } else {
-    // ⬇ fallback – uzmi sva pitanja iz svih tonova
-    Object.values(settings.tone_questions).forEach(q => {
-      if (Array.isArray(q)) {
-        allQuestions.push(...q);
-      } else if (typeof q === "string") {
-        allQuestions.push(q);
-      }
-    });
-  }
-
-  const valid = allQuestions.filter(q => q && q.trim());
-
-  if (valid.length > 0) {
-    const randomIndex = Math.floor(Math.random() * valid.length);
-    setQuestion(valid[randomIndex]);
-  }
-}, [selectedTone, settings]);
-
-
-  const backgroundImage = settings.background_image || 'https://images.unsplash.com/photo-1519741497674-611481863552?w=800&q=80';
+  const backgroundImage = assetUrl(settings.background_image) || 'https://images.unsplash.com/photo-1519741497674-611481863552?w=800&q=80';
 
   return (
     <div className="min-h-screen flex flex-col items-center justify-center relative overflow-hidden">
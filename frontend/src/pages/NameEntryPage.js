@@ -5,7 +5,7 @@ import { useMemora } from '../context/MemoraContext';
 
 const NameEntryPage = () => {
   const navigate = useNavigate();
-  const { guestName, setGuestName, settings } = useMemora();
+  const { guestName, setGuestName, settings, assetUrl } = useMemora();
   const [inputValue, setInputValue] = useState(guestName);
 
   const handleContinue = () => {
@@ -21,7 +21,7 @@ const NameEntryPage = () => {
     }
   };
 
-  const backgroundImage = settings.background_image || 'https://images.unsplash.com/photo-1519741497674-611481863552?w=800&q=80';
+  const backgroundImage = assetUrl(settings.background_image) || 'https://images.unsplash.com/photo-1519741497674-611481863552?w=800&q=80';
 
   return (
     <div className="min-h-screen flex flex-col items-center justify-center relative overflow-hidden">
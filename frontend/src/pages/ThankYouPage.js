@@ -8,14 +8,14 @@ import mojlogo from "../assets/mojlogo.png";
 
 const ThankYouPage = () => {
   const navigate = useNavigate();
-  const { resetMemory, settings } = useMemora();
+  const { resetMemory, settings, assetUrl } = useMemora();
 
   const handleClose = () => {
     resetMemory();
     navigate('/');
   };
 
-  const backgroundImage = settings.background_image || 'https://images.unsplash.com/photo-1519741497674-611481863552?w=800&q=80';
+  const backgroundImage = assetUrl(settings.background_image) || 'https://images.unsplash.com/photo-1519741497674-611481863552?w=800&q=80';
 
   return (
     <div className="min-h-screen flex flex-col items-center justify-center relative overflow-hidden">
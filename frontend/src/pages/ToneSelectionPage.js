@@ -12,7 +12,7 @@ const toneOptions = [
 
 const ToneSelectionPage = () => {
   const navigate = useNavigate();
-  const { guestName, settings, setSelectedTone } = useMemora();
+  const { guestName, settings, setSelectedTone, assetUrl } = useMemora();
   const [hasCheckedRedirect, setHasCheckedRedirect] = useState(false);
 
   // Check redirects only once on mount
@@ -32,7 +32,7 @@ const ToneSelectionPage = () => {
     navigate('/message');
   };
 
-  const backgroundImage = settings.background_image || 'https://images.unsplash.com/photo-1519741497674-611481863552?w=800&q=80';
+  const backgroundImage = assetUrl(settings.background_image) || 'https://images.unsplash.com/photo-1519741497674-611481863552?w=800&q=80';
 
   // Don't render if we need to redirect
   if (!guestName || settings.tone_page_enabled === false) {
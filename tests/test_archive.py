@@ -0,0 +1,120 @@
+import asyncio
+import io
+import json
+import tarfile
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from pymongo.errors import DuplicateKeyError  # noqa: E402
+
+from archive import import_event_archive, stream_event_archive  # noqa: E402
+from images import InvalidImage  # noqa: E402
+from storage import LocalBlobStore, blob_key  # noqa: E402
+
+EVENT = {"id": "e1", "code": "ABC123", "name": "Wedding", "couple_names": "Ana & Ivan", "is_active": True}
+
+
+def jpeg():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), (200, 30, 30)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def memory(n, photo_key=None):
+    return {"id": f"m{n}", "event_id": "e1", "guest_name": f"Guest {n}", "message": "Hi",
+            "created_at": f"2026-06-20T18:00:{n:02d}+00:00", "photo_key": photo_key}
+
+
+def write_archive(path, members):
+    with tarfile.open(path, "w") as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def ndjson(docs):
+    return b"".join(json.dumps(doc).encode() + b"\n" for doc in docs)
+
+
+@pytest.fixture
+def db():
+    database = mongomock_motor.AsyncMongoMockClient()["memora_test"]
+    asyncio.run(database.events.create_index("id", unique=True))
+    return database
+
+
+@pytest.fixture
+def blob_store(tmp_path):
+    return LocalBlobStore(tmp_path / "blobs")
+
+
+def test_export_and_import_round_trip(db, blob_store, tmp_path):
+    async def run():
+        photo_key = await blob_store.put(jpeg())
+        await db.events.insert_one(dict(EVENT))
+        await db.memories.insert_many([memory(n, photo_key if n % 2 else None) for n in range(5)])
+        path = tmp_path / "event.tar"
+        with open(path, "wb") as out:
+            async for chunk in stream_event_archive(db, blob_store, dict(EVENT), batch_size=2):
+                out.write(chunk)
+
+        target = mongomock_motor.AsyncMongoMockClient()["restored"]
+        target_store = LocalBlobStore(tmp_path / "restored-blobs")
+        event, imported = await import_event_archive(target, target_store, path, batch_size=2)
+        assert event["id"] == "e1" and imported == 5
+        restored = await target.memories.find({}, {"_id": 0}).sort("created_at", 1).to_list(None)
+        assert [m["id"] for m in restored] == [f"m{n}" for n in range(5)]
+        assert await target_store.get(photo_key) == await blob_store.get(photo_key)
+        assert restored[1]["photo_renditions"]["thumb"]["key"]
+    asyncio.run(run())
+
+
+def test_failed_import_leaves_nothing_behind_and_can_be_retried(db, blob_store, tmp_path):
+    good, bad = jpeg(), b"not an image"
+    good_key, bad_key = blob_key(good), blob_key(bad)
+    broken = tmp_path / "broken.tar"
+    write_archive(broken, [
+        ("event.json", json.dumps(EVENT).encode()),
+        ("photos/" + good_key, good),
+        ("memories/000001.ndjson", ndjson([memory(0, good_key), memory(1)])),
+        ("photos/" + bad_key, bad),
+        ("memories/000002.ndjson", ndjson([memory(2, bad_key)])),
+    ])
+    fixed = tmp_path / "fixed.tar"
+    write_archive(fixed, [
+        ("event.json", json.dumps(EVENT).encode()),
+        ("photos/" + good_key, good),
+        ("memories/000001.ndjson", ndjson([memory(0, good_key), memory(1), memory(2)])),
+    ])
+
+    async def run():
+        with pytest.raises(InvalidImage):
+            await import_event_archive(db, blob_store, broken)
+        assert await db.events.count_documents({}) == 0
+        assert await db.memories.count_documents({}) == 0
+
+        event, imported = await import_event_archive(db, blob_store, fixed)
+        assert event["id"] == "e1" and imported == 3
+        assert await db.events.count_documents({}) == 1
+    asyncio.run(run())
+
+
+def test_import_of_an_existing_event_leaves_it_untouched(db, blob_store, tmp_path):
+    path = tmp_path / "event.tar"
+    write_archive(path, [
+        ("event.json", json.dumps(EVENT).encode()),
+        ("memories/000001.ndjson", ndjson([memory(9)])),
+    ])
+
+    async def run():
+        await db.events.insert_one({**EVENT, "name": "Existing"})
+        await db.memories.insert_one(memory(0))
+        with pytest.raises(DuplicateKeyError):
+            await import_event_archive(db, blob_store, path)
+        assert (await db.events.find_one({"id": "e1"}))["name"] == "Existing"
+        assert [m["id"] async for m in db.memories.find({})] == ["m0"]
+    asyncio.run(run())
@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+
+from cache import AsyncTTLCache
+
+
+def test_concurrent_misses_share_one_load():
+    cache = AsyncTTLCache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"code": "ABC123"}
+
+    async def run():
+        values = await asyncio.gather(*(cache.get_or_load("ABC123", loader) for _ in range(20)))
+        assert len(calls) == 1
+        assert all(value is values[0] for value in values)
+        assert await cache.get_or_load("ABC123", loader) is values[0]
+        assert len(calls) == 1
+    asyncio.run(run())
+
+
+def test_failed_load_is_not_cached_and_can_be_retried():
+    cache = AsyncTTLCache()
+    attempts = []
+
+    async def loader():
+        attempts.append(1)
+        await asyncio.sleep(0)
+        if len(attempts) == 1:
+            raise RuntimeError("database unavailable")
+        return "value"
+
+    async def run():
+        results = await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(3)),
+                                       return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert cache._loading == {}
+        assert await cache.get_or_load("key", loader) == "value"
+        assert len(attempts) == 2
+    asyncio.run(run())
+
+
+def test_cancelled_caller_does_not_cancel_shared_load():
+    cache = AsyncTTLCache()
+
+    async def loader():
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def run():
+        first = asyncio.ensure_future(cache.get_or_load("key", loader))
+        second = asyncio.ensure_future(cache.get_or_load("key", loader))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "value"
+        assert cache._lookup("key") == (True, "value")
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("invalidate", [
+    lambda cache: cache.invalidate("key"),
+    lambda cache: cache.invalidate_where(lambda key, value: False),
+    lambda cache: cache.clear(),
+])
+def test_invalidation_during_load_discards_the_loaded_value(invalidate):
+    cache = AsyncTTLCache()
+    versions = iter(["old", "new"])
+
+    async def loader():
+        value = next(versions)
+        await asyncio.sleep(0.01)
+        return value
+
+    async def run():
+        load = asyncio.ensure_future(cache.get_or_load("key", loader))
+        await asyncio.sleep(0)
+        invalidate(cache)
+        # The caller that started the load still gets its value...
+        assert await load == "old"
+        # ...but it is not cached past the invalidation
+        assert await cache.get_or_load("key", loader) == "new"
+    asyncio.run(run())
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AsyncTTLCache(maxsize=2)
+
+    async def run():
+        for key in ("a", "b"):
+            await cache.get_or_load(key, lambda key=key: _value(key))
+        # Touch "a" so "b" is the least recently used
+        await cache.get_or_load("a", _unexpected)
+        await cache.get_or_load("c", lambda: _value("c"))
+        assert list(cache._entries) == ["a", "c"]
+        assert cache._lookup("b") == (False, None)
+    asyncio.run(run())
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("cache.time.monotonic", lambda: now[0])
+    cache = AsyncTTLCache(ttl=30)
+    cache._store("key", "value")
+    now[0] += 29
+    assert cache._lookup("key") == (True, "value")
+    now[0] += 2
+    assert cache._lookup("key") == (False, None)
+
+
+def test_no_ttl_keeps_entries_until_invalidated(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("cache.time.monotonic", lambda: now[0])
+    cache = AsyncTTLCache(ttl=None)
+    cache._store("key", "value")
+    now[0] += 10 ** 6
+    assert cache._lookup("key") == (True, "value")
+    cache.invalidate("key")
+    assert cache._lookup("key") == (False, None)
+
+
+def test_none_is_only_cached_when_asked():
+    async def run():
+        for cache_none, expected_calls in ((False, 2), (True, 1)):
+            cache = AsyncTTLCache(cache_none=cache_none)
+            calls = []
+
+            async def loader():
+                calls.append(1)
+                return None
+
+            assert await cache.get_or_load("missing", loader) is None
+            assert await cache.get_or_load("missing", loader) is None
+            assert len(calls) == expected_calls
+    asyncio.run(run())
+
+
+async def _value(value):
+    return value
+
+
+async def _unexpected():
+    raise AssertionError("should have been a cache hit")
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import export_jobs  # noqa: E402
+from export_jobs import ExportJobManager  # noqa: E402
+
+
+@pytest.fixture
+def manager(tmp_path):
+    db = mongomock_motor.AsyncMongoMockClient()["memora_test"]
+    asyncio.run(db.memories.insert_one({"id": "m1", "event_id": "e1", "created_at": "2026-06-20T18:00:00+00:00"}))
+    return ExportJobManager(db, tmp_path)
+
+
+def version(manager, title="Ana & Ivan", profile="print"):
+    return asyncio.run(manager.event_version("e1", title, profile))[0]
+
+
+def test_version_is_stable(manager):
+    assert version(manager) == version(manager)
+
+
+def test_version_changes_with_the_memories(manager):
+    before = version(manager)
+    asyncio.run(manager.db.memories.insert_one({"id": "m2", "event_id": "e1", "created_at": "2026-06-20T19:00:00+00:00"}))
+    assert version(manager) != before
+
+
+def test_version_changes_with_the_title_and_profile(manager):
+    assert version(manager, title="Ana & Marko") != version(manager)
+    assert version(manager, profile="screen") != version(manager)
+
+
+def test_version_changes_with_the_renderer(manager, monkeypatch):
+    before = version(manager)
+    monkeypatch.setattr(export_jobs, "PAGE_RENDER_VERSION", export_jobs.PAGE_RENDER_VERSION + 1)
+    assert version(manager) != before
+
+
+def test_cached_artifact_is_only_served_for_its_title(manager):
+    path = manager.artifact_path("e1", version(manager), "print")
+    path.write_bytes(b"%PDF-1.4")
+    assert asyncio.run(manager.cached_artifact("e1", "Ana & Ivan", "print"))[0] == path
+    assert asyncio.run(manager.cached_artifact("e1", "Ana & Marko", "print"))[0] is None
@@ -0,0 +1,65 @@
+import asyncio
+import socket
+
+import pytest
+
+from broadcast import CacheBroadcast
+from feed import RESET, LocalFeed
+
+
+def make_delta(kind, memory):
+    return {"type": kind, "id": memory["id"]}
+
+
+async def next_item(subscription):
+    return await asyncio.wait_for(subscription.__anext__(), 1)
+
+
+def test_subscriber_receives_published_deltas_and_resumes():
+    async def run():
+        feed = LocalFeed(make_delta)
+        subscription = feed.subscribe("e1")
+        pending = asyncio.ensure_future(next_item(subscription))
+        await asyncio.sleep(0.05)
+        feed.publish("created", {"event_id": "e1", "id": "m1"})
+        feed.publish("created", {"event_id": "e2", "id": "other"})
+        feed.publish("deleted", {"event_id": "e1", "id": "m1"})
+        token, delta = await pending
+        assert delta == {"type": "created", "id": "m1"}
+        assert (await next_item(subscription))[1] == {"type": "deleted", "id": "m1"}
+        await subscription.aclose()
+
+        replayed = feed.subscribe("e1", token)
+        assert (await next_item(replayed))[1] == {"type": "deleted", "id": "m1"}
+        await replayed.aclose()
+        unknown = feed.subscribe("e1", "another-process-7")
+        assert (await next_item(unknown))[1] == RESET
+        await unknown.aclose()
+    asyncio.run(run())
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs Unix sockets")
+def test_deltas_reach_subscribers_of_other_workers(tmp_path):
+    async def run():
+        feeds, channels = {}, {}
+        for worker in ("a", "b"):
+            channels[worker] = CacheBroadcast(
+                tmp_path, lambda message, worker=worker: feeds[worker].deliver(message["event_id"], message["delta"])
+            )
+            feeds[worker] = LocalFeed(make_delta, relay=lambda event_id, delta, worker=worker: channels[worker].publish(
+                {"feed": "memory", "event_id": event_id, "delta": delta}
+            ))
+            channels[worker].start()
+        try:
+            subscription = feeds["a"].subscribe("e1")
+            pending = asyncio.ensure_future(next_item(subscription))
+            await asyncio.sleep(0.05)
+            feeds["b"].publish("created", {"event_id": "e1", "id": "m1"})
+            assert (await pending)[1] == {"type": "created", "id": "m1"}
+            # Delivered deltas are not relayed again
+            assert feeds["b"].seq == 1 and feeds["a"].seq == 1
+            await subscription.aclose()
+        finally:
+            for channel in channels.values():
+                channel.stop()
+    asyncio.run(run())
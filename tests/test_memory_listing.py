@@ -0,0 +1,160 @@
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+httpx = pytest.importorskip("httpx")
+
+_workdir = tempfile.mkdtemp(prefix="memora-tests-")
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "memora_test")
+for _name in ("BLOB_DIR", "EXPORT_DIR", "PAGE_CACHE_DIR", "INGEST_DIR", "BROADCAST_DIR"):
+    os.environ.setdefault(_name, os.path.join(_workdir, _name.lower()))
+
+import server  # noqa: E402
+
+START = datetime(2026, 6, 20, 18, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def db():
+    database = mongomock_motor.AsyncMongoMockClient()["memora_test"]
+    server.bind_database(database)
+    return database
+
+
+def memories(count, event_id="e1", same_time_every=1):
+    """``count`` memories; each run of ``same_time_every`` shares a created_at."""
+    return [
+        {
+            "id": f"{event_id}-{n:04d}",
+            "event_id": event_id,
+            "guest_name": f"Guest {n}",
+            "message": "Congratulations!",
+            "created_at": (START + timedelta(seconds=n // same_time_every)).isoformat(),
+        }
+        for n in range(count)
+    ]
+
+
+def newest_first(docs):
+    return [doc["id"] for doc in sorted(docs, key=lambda doc: (doc["created_at"], doc["id"]), reverse=True)]
+
+
+async def walk(url, **params):
+    """Follow X-Next-Cursor from the first page to the last."""
+    pages = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+        cursor = None
+        while True:
+            response = await client.get(url, params={**params, **({"cursor": cursor} if cursor else {})})
+            assert response.status_code == 200
+            pages.append(response.json())
+            cursor = response.headers.get("x-next-cursor")
+            if not cursor:
+                return pages
+
+
+def ids(pages):
+    return [memory["id"] for page in pages for memory in page]
+
+
+@pytest.mark.parametrize("same_time_every", [1, 4, 100])
+def test_cursor_walk_has_no_gaps_or_duplicates(db, same_time_every):
+    docs = memories(100, same_time_every=same_time_every)
+
+    async def run():
+        await db.memories.insert_many([dict(doc) for doc in docs])
+        return await walk("/api/events/e1/memories", limit=7)
+
+    pages = asyncio.run(run())
+    assert [len(page) for page in pages] == [7] * 14 + [2]
+    assert ids(pages) == newest_first(docs)
+
+
+def test_page_boundary_inside_a_run_of_equal_timestamps(db):
+    # Every page ends in the middle of a run of ten memories sharing a time
+    docs = memories(30, same_time_every=10)
+
+    async def run():
+        await db.memories.insert_many([dict(doc) for doc in docs])
+        return await walk("/api/memories", limit=3)
+
+    assert ids(asyncio.run(run())) == newest_first(docs)
+
+
+def test_last_full_page_has_no_cursor(db):
+    async def run():
+        await db.memories.insert_many(memories(10))
+        return await walk("/api/events/e1/memories", limit=5)
+
+    assert [len(page) for page in asyncio.run(run())] == [5, 5]
+
+
+def test_listing_is_limited_to_the_event(db):
+    docs = memories(12, "e1") + memories(9, "e2")
+
+    async def run():
+        await db.memories.insert_many([dict(doc) for doc in docs])
+        return (await walk("/api/events/e2/memories", limit=4),
+                await walk("/api/memories", event_id="e1", limit=4),
+                await walk("/api/memories", limit=4))
+
+    e2, e1, everything = asyncio.run(run())
+    assert ids(e2) == newest_first(docs[12:])
+    assert ids(e1) == newest_first(docs[:12])
+    assert ids(everything) == newest_first(docs)
+
+
+@pytest.mark.parametrize("limit, expected", [
+    (0, 1),
+    (-5, 1),
+    (1, 1),
+    (server.MEMORY_MAX_PAGE_SIZE + 1, server.MEMORY_MAX_PAGE_SIZE),
+    (10 ** 6, server.MEMORY_MAX_PAGE_SIZE),
+])
+def test_limit_is_clamped(db, limit, expected):
+    async def run():
+        await db.memories.insert_many(memories(server.MEMORY_MAX_PAGE_SIZE + 10))
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+            return await client.get("/api/events/e1/memories", params={"limit": limit})
+
+    response = asyncio.run(run())
+    assert len(response.json()) == expected
+    assert "x-next-cursor" in response.headers
+
+
+def test_default_page_size(db):
+    async def run():
+        await db.memories.insert_many(memories(server.MEMORY_PAGE_SIZE + 1))
+        return await walk("/api/events/e1/memories")
+
+    assert [len(page) for page in asyncio.run(run())] == [server.MEMORY_PAGE_SIZE, 1]
+
+
+def test_cursor_walk_with_field_projection(db):
+    docs = memories(20, same_time_every=3)
+
+    async def run():
+        await db.memories.insert_many([dict(doc) for doc in docs])
+        return await walk("/api/events/e1/memories", limit=6, fields="guest_name")
+
+    pages = asyncio.run(run())
+    assert all(set(memory) == {"guest_name"} for page in pages for memory in page)
+    assert [memory["guest_name"] for page in pages for memory in page] == [
+        f"Guest {int(memory_id.split('-')[1])}" for memory_id in newest_first(docs)
+    ]
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "e30", "W10", "W3siJG5lIjogbnVsbH0sIHsiJG5lIjogbnVsbH1d"])
+def test_invalid_cursor_is_rejected(db, cursor):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+            return await client.get("/api/events/e1/memories", params={"cursor": cursor})
+
+    response = asyncio.run(run())
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
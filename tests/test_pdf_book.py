@@ -0,0 +1,111 @@
+import re
+from io import BytesIO
+
+import pytest
+
+pypdf = pytest.importorskip("pypdf")
+
+from pdf_book import PdfConcatenator, render_pages  # noqa: E402
+
+
+def jpeg(color, size=(400, 300)):
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+RED, BLUE = jpeg((200, 30, 30)), jpeg((30, 30, 200))
+
+
+def memory(n, photo=None, message="Wishing you every happiness."):
+    return {"id": f"m{n}", "guest_name": f"Guest {n}", "question": "Any advice?",
+            "message": message, "photo": photo}
+
+
+def merge(fragments, title="Ana & Ivan"):
+    merger = PdfConcatenator()
+    return merger.header() + b"".join(merger.add(fragment) for fragment in fragments) + merger.finish(title)
+
+
+def book(pages, layout="event"):
+    # One fragment per render_pages call, as separate pool tasks produce them
+    return merge([fragment for page in pages for fragment in render_pages([page], layout)])
+
+
+def xobjects(page):
+    """``{name: object number}`` of the page's XObjects, forms included."""
+    refs = page["/Resources"].get_object()["/XObject"].get_object()
+    return {name: ref.idnum for name, ref in refs.items()}
+
+
+def test_merged_book_has_every_page_in_order():
+    pages = [memory(n, RED if n % 2 else None) for n in range(5)]
+    reader = pypdf.PdfReader(BytesIO(book(pages)), strict=True)
+    assert len(reader.pages) == 5
+    assert [f"Guest {n}" in page.extract_text() for n, page in enumerate(reader.pages)] == [True] * 5
+    assert reader.metadata.title == "Ana & Ivan"
+
+
+def test_xref_table_points_at_every_object():
+    data = book([memory(n, RED) for n in range(3)])
+    reader = pypdf.PdfReader(BytesIO(data), strict=True)
+    xref = data[int(data[data.rindex(b"startxref") + 9:].split()[0]):]
+    assert xref.startswith(b"xref\n0 ")
+    entries = re.findall(rb"(\d{10}) (\d{5}) ([nf]) \n", xref)
+    size = int(xref.split()[2])
+    assert len(entries) == size == reader.trailer["/Size"]
+    for num, (offset, _, kind) in enumerate(entries):
+        if kind == b"n":
+            assert data[int(offset):].startswith(b"%d 0 obj" % num)
+    for num in range(1, size):
+        assert reader.get_object(num) is not None
+
+
+def test_identical_photos_are_stored_once():
+    pages = [memory(0, RED), memory(1, BLUE), memory(2, RED), memory(3, RED)]
+    data = book(pages)
+    reader = pypdf.PdfReader(BytesIO(data), strict=True)
+    images = [
+        {num for num in xobjects(page).values() if reader.get_object(num)["/Subtype"] == "/Image"}
+        for page in reader.pages
+    ]
+    assert images[0] == images[2] == images[3]
+    assert images[0] != images[1]
+    assert data.count(b"/Subtype /Image") == 2
+
+
+def test_page_furniture_form_is_shared_by_every_page():
+    reader = pypdf.PdfReader(BytesIO(book([memory(n) for n in range(4)])), strict=True)
+    forms = [
+        {num for num in xobjects(page).values() if reader.get_object(num)["/Subtype"] == "/Form"}
+        for page in reader.pages
+    ]
+    assert len(forms[0]) == 1
+    assert all(page_forms == forms[0] for page_forms in forms)
+    form = reader.get_object(next(iter(forms[0])))
+    # The furniture survives the merge with its own resources and content
+    assert "This is your page in" in form.get_data().decode("latin-1")
+    assert "/Font" in form["/Resources"]
+
+
+def test_continuation_pages_share_their_own_form():
+    pages = [memory(0, message="memories " * 4000), memory(1, message="memories " * 4000), memory(2)]
+    reader = pypdf.PdfReader(BytesIO(book(pages)), strict=True)
+    assert len(reader.pages) > 5
+    forms = {num for page in reader.pages for num in xobjects(page).values()
+             if reader.get_object(num)["/Subtype"] == "/Form"}
+    # One form for memory pages and one for continuation pages
+    assert len(forms) == 2
+
+
+def test_fonts_are_stored_once():
+    data = book([memory(n) for n in range(6)])
+    fonts = re.findall(rb"/BaseFont /([\w-]+)", data)
+    assert len(fonts) == len(set(fonts))
+
+
+def test_layouts_merge_into_one_book():
+    fragments = render_pages([memory(0, RED)], "event") + render_pages([memory(1, RED)], "classic")
+    reader = pypdf.PdfReader(BytesIO(merge(fragments)), strict=True)
+    assert len(reader.pages) == 2
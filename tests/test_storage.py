@@ -0,0 +1,120 @@
+import asyncio
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+from storage import BlobNotFound, BlobStore, LocalBlobStore, S3BlobStore, blob_key, carries_metadata
+
+
+class StubS3Client:
+    """The calls S3BlobStore makes, against an in-memory bucket."""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body
+
+    def upload_file(self, Filename, Bucket, Key):
+        self.objects[(Bucket, Key)] = Path(Filename).read_bytes()
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {"Body": BytesIO(self.objects[(Bucket, Key)])}
+
+    def head_object(self, Bucket, Key):
+        from botocore.exceptions import ClientError
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+@pytest.fixture(params=["local", "s3"])
+def store(request, tmp_path):
+    if request.param == "local":
+        return LocalBlobStore(tmp_path / "blobs")
+    pytest.importorskip("botocore")
+    return S3BlobStore("photos", client=StubS3Client())
+
+
+def test_put_get_exists_delete(store):
+    async def run():
+        key = await store.put(b"photo")
+        assert key == blob_key(b"photo")
+        assert await store.put(b"photo") == key
+        assert await store.get(key) == b"photo"
+        assert await store.exists(key)
+        await store.delete(key)
+        assert not await store.exists(key)
+        with pytest.raises(BlobNotFound):
+            await store.get(key)
+    asyncio.run(run())
+
+
+def test_streamed_upload(store):
+    async def run():
+        writer = store.writer()
+        for chunk in (b"\xff\xd8\xff", b"rest of ", b"the photo"):
+            await writer.write(chunk)
+        key = await writer.commit()
+        assert key == blob_key(b"\xff\xd8\xffrest of the photo")
+        assert writer.head == b"\xff\xd8\xffrest of the p"
+        assert await store.get(key) == b"\xff\xd8\xffrest of the photo"
+        assert not Path(writer.path).exists()
+    asyncio.run(run())
+
+
+def test_aborted_upload_is_not_stored(store):
+    async def run():
+        writer = store.writer()
+        await writer.write(b"partial")
+        await writer.abort()
+        assert not Path(writer.path).exists()
+        assert not await store.exists(blob_key(b"partial"))
+    asyncio.run(run())
+
+
+def test_s3_keys_are_prefixed():
+    client = StubS3Client()
+    store = S3BlobStore("photos", prefix="memora/", client=client)
+    key = asyncio.run(store.put(b"photo"))
+    assert list(client.objects) == [("photos", f"memora/{key}")]
+
+
+def test_rejects_keys_that_are_not_hashes(store):
+    with pytest.raises(BlobNotFound):
+        asyncio.run(store.get("../secrets"))
+
+
+def test_incomplete_backend_fails_on_creation():
+    class ReadOnlyStore(BlobStore):
+        def _read(self, key):
+            return b""
+
+    with pytest.raises(TypeError):
+        ReadOnlyStore()
+
+
+@pytest.mark.parametrize("fmt", ["JPEG", "PNG", "WEBP"])
+def test_metadata_is_detected_in_originals_but_not_renditions(fmt):
+    from PIL import Image
+    from images import render
+
+    exif = Image.Exif()
+    exif[0x8825] = {1: "N"}  # GPS
+    image = Image.new("RGB", (300, 200), (10, 20, 30))
+    with_exif, without = BytesIO(), BytesIO()
+    image.save(with_exif, fmt, exif=exif.tobytes())
+    image.save(without, fmt)
+    assert carries_metadata(with_exif.getvalue())
+    assert not carries_metadata(without.getvalue())
+    assert not any(carries_metadata(data) for data, _, _ in render(with_exif.getvalue()).values())
@@ -0,0 +1,80 @@
+from io import BytesIO
+
+import pytest
+
+from text_layout import fit_message, lines_fitting, text_width, wrap
+
+FONT = "Helvetica"
+
+
+def test_text_width_matches_reportlab():
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    text = "Congratulations to the happy couple!"
+    assert text_width(text, FONT, 14) == pytest.approx(stringWidth(text, FONT, 14))
+
+
+def test_wrap_fills_lines_greedily():
+    text = "the quick brown fox jumps over the lazy dog " * 20
+    lines = wrap(text, FONT, 12, 200)
+    assert " ".join(lines) == " ".join(text.split())
+    for line, following in zip(lines, lines[1:]):
+        assert text_width(line, FONT, 12) < 200
+        # The next line's first word did not fit on this one
+        assert text_width(f"{line} {following.split()[0]}", FONT, 12) >= 200
+
+
+def test_wrap_splits_a_word_wider_than_the_line():
+    word = "a" * 500
+    lines = wrap(f"before {word} after", FONT, 12, 100)
+    assert lines[0] == "before"
+    assert "".join(lines[1:]).replace(" after", "") == word
+    assert all(text_width(line, FONT, 12) < 100 for line in lines)
+
+
+def test_wrap_handles_a_single_character_wider_than_the_line():
+    assert wrap("WW", FONT, 40, 10) == ["W", "W"]
+
+
+@pytest.mark.parametrize("message", ["", "   ", "\n\n"])
+def test_empty_messages_have_no_lines(message):
+    assert wrap(message, FONT, 12, 100) == []
+    layout = fit_message(message, FONT, 14, 22, 300, 100, 10)
+    assert layout.lines == () and layout.overflow == ()
+    assert layout.size == 14
+
+
+def test_lines_fitting_counts_the_first_baseline():
+    assert lines_fitting(0, 20) == 1
+    assert lines_fitting(59, 20) == 3
+    assert lines_fitting(60, 20) == 4
+
+
+def test_fit_message_shrinks_to_fit():
+    message = "word " * 60
+    layout = fit_message(message, FONT, 14, 22, 300, 100, 8)
+    assert layout.size < 14
+    assert layout.leading == pytest.approx(22 * layout.size / 14)
+    assert layout.overflow == ()
+    assert len(layout.lines) <= lines_fitting(100, layout.leading)
+
+
+def test_fit_message_overflows_below_the_minimum_size():
+    message = "memories " * 2000
+    layout = fit_message(message, FONT, 14, 22, 300, 100, 10)
+    assert layout.size == 10
+    assert len(layout.lines) == lines_fitting(100, layout.leading)
+    assert layout.overflow
+    assert " ".join(layout.lines + layout.overflow) == message.strip()
+
+
+def test_long_message_continues_over_several_pages():
+    pypdf = pytest.importorskip("pypdf")
+    from pdf_book import render_pages
+
+    page = {"id": "m1", "guest_name": "Ana", "question": "Advice?", "message": "memories " * 4000}
+    short = {"id": "m2", "guest_name": "Ivan", "question": "Advice?", "message": "Be happy"}
+    long_fragment, short_fragment = render_pages([page, short], "event")
+    long_pages = pypdf.PdfReader(BytesIO(long_fragment)).pages
+    assert len(long_pages) > 2
+    assert "Ana, continued" in long_pages[-1].extract_text()
+    assert len(pypdf.PdfReader(BytesIO(short_fragment)).pages) == 1